@@ -1,52 +1,226 @@
+import asyncio
+import importlib.util
+import logging
+
 import httpx
 from datetime import datetime, timedelta
-from config import ADSTERRA_API_KEY
+from telegram.helpers import escape_markdown
+import tenants
+from aggregate import Columns, collect, summarize
+from cache import TTLCache
+from jsonstream import iter_items
+from metrics import register_cache
+from resilience import UpstreamError
+from config import (
+    FANOUT_CONCURRENCY,
+    STATS_CACHE_SIZE,
+    STATS_CACHE_TTL_LIVE,
+    STATS_CACHE_TTL_CLOSED,
+    MUTABLE_DAYS,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE,
+    HTTP_KEEPALIVE_EXPIRY,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUT,
+    STREAM_MIN_DAYS,
+    REPORT_PAGE_SIZE
+)
+
+logger = logging.getLogger(__name__)
+
+BASE_URL = "https://api3.adsterratools.com/publisher"
+
+# One client (connection pool) per tenant, created on first use and closed in
+# post_shutdown. Options given to init_client apply to every tenant's client.
+_client_options = {}
+
+def init_client(**kwargs):
+    _client_options.update(kwargs)
+    for tenant in tenants.all_tenants():
+        get_client(tenant)
+
+def _new_client():
+    return httpx.AsyncClient(
+        base_url=BASE_URL,
+        # HTTP/2 only when the h2 package is installed (httpx[http2])
+        http2=importlib.util.find_spec("h2") is not None,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(
+            HTTP_READ_TIMEOUT,
+            connect=HTTP_CONNECT_TIMEOUT,
+            read=HTTP_READ_TIMEOUT
+        ),
+        **_client_options
+    )
+
+async def close_client():
+    for tenant in tenants.all_tenants():
+        await tenant.close()
 
-async def get_stats(start_date, end_date, domain=None, placement=None, group_by="date"):
-    base_url = "https://api3.adsterratools.com/publisher/stats.json"
+# Report cache for get_stats, keyed on the tenant and the normalized query
+stats_cache = TTLCache(maxsize=STATS_CACHE_SIZE, default_ttl=STATS_CACHE_TTL_LIVE, namespace="stats")
+register_cache("stats", stats_cache)
+
+def get_client(tenant=None):
+    # Also works outside the Application lifecycle (e.g. scripts), given a tenant
+    tenant = tenant or tenants.active()
+    if tenant.client is None:
+        tenant.client = _new_client()
+    return tenant.client
+
+def _send(method, url, **kwargs):
+    # Rate limit, retries and circuit breaker of the active tenant
+    tenant = tenants.active()
+    return tenant.upstream.send(get_client(tenant), method, url, **kwargs)
+
+def _headers():
+    return {
+        "Accept": "application/json",
+        "X-API-Key": tenants.active().api_key
+    }
+
+def stats_cache_key(start_date, end_date, domain=None, placement=None, group_by="date"):
+    # Every tenant has its own entries, in this process and in the shared cache
+    return (
+        tenants.active().id,
+        str(start_date),
+        str(end_date),
+        int(domain) if domain else None,
+        int(placement) if placement else None,
+        tuple(group_by) if isinstance(group_by, (list, tuple)) else group_by or "date"
+    )
+
+def stats_ttl(end_date):
+    # Closed historical ranges don't change anymore, ranges that reach into the
+    # last MUTABLE_DAYS (yesterday is still revised) do
+    mutable_from = datetime.now().date() - timedelta(days=MUTABLE_DAYS - 1)
+    if end_date and str(end_date) < mutable_from.isoformat():
+        return STATS_CACHE_TTL_CLOSED
+    return STATS_CACHE_TTL_LIVE
+
+def range_days(start_date, end_date):
+    # Missing dates count as today
+    today = datetime.now().date()
+    start = datetime.strptime(str(start_date), '%Y-%m-%d').date() if start_date else today
+    end = datetime.strptime(str(end_date), '%Y-%m-%d').date() if end_date else today
+    return (end - start).days + 1
+
+async def get_stats(start_date, end_date, domain=None, placement=None, group_by="date", refresh=False, ttl=None):
+    key = stats_cache_key(start_date, end_date, domain, placement, group_by)
+    # Long ranges are streamed into compact columns instead of a list of dicts
+    fetch = fetch_stats_streamed if range_days(start_date, end_date) >= STREAM_MIN_DAYS else fetch_stats
+    return await stats_cache.get_or_load(
+        key,
+        lambda: fetch(*key[1:]),
+        ttl=ttl or stats_ttl(end_date),
+        force=refresh
+    )
+
+def _stats_request(start_date, end_date, domain, placement, group_by):
     params = {
         "start_date": start_date,
-        "finish_date": end_date,
-        "group_by": group_by
+        "finish_date": end_date
     }
 
+    # Several dimensions are sent as an array: group_by[]=date&group_by[]=country
+    if isinstance(group_by, (list, tuple)):
+        params["group_by[]"] = list(group_by)
+    else:
+        params["group_by"] = group_by
+
     if domain:
         params["domain"] = domain
     if placement:
         params["placement"] = placement
 
-    headers = {
-        "Accept": "application/json",
-        "X-API-Key": ADSTERRA_API_KEY
-    }
+    return params, _headers()
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(base_url, headers=headers, params=params)
-            if response.status_code == 200:
-                return response.json()
-            return None
-        except Exception as e:
-            print(f"API Error: {e}")
-            return None
-
-async def get_placements(domain_id):
-    url = f"https://api3.adsterratools.com/publisher/domain/{domain_id}/placements.json"
-    headers = {
-        "X-API-Key": ADSTERRA_API_KEY,
-        "Accept": "application/json"
-    }
+async def fetch_stats(start_date, end_date, domain=None, placement=None, group_by="date"):
+    params, headers = _stats_request(start_date, end_date, domain, placement, group_by)
 
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(url, headers=headers)
-            if resp.status_code == 200:
-                data = resp.json()
-                return data.get("items", [])
+        response = await _send("GET", "/stats.json", headers=headers, params=params)
+        if response.status_code == 200:
+            return response.json()
+        return None
     except Exception as e:
-        print(f"Placements API Error: {e}")
-    
-    return []
+        print(f"API Error: {e}")
+        return None
+
+async def stream_stats(start_date, end_date, domain=None, placement=None, group_by="date", meta=None):
+    # Yields stats items while the response body is still downloading.
+    # Top-level fields other than "items" end up in `meta`.
+    params, headers = _stats_request(start_date, end_date, domain, placement, group_by)
+
+    response = await _send("GET", "/stats.json", stream=True, headers=headers, params=params)
+    try:
+        if response.status_code != 200:
+            raise UpstreamError(response.status_code)
+        async for item in iter_items(response.aiter_text(), meta=meta):
+            yield item
+    finally:
+        await response.aclose()
+
+async def fetch_stats_streamed(start_date, end_date, domain=None, placement=None, group_by="date"):
+    # Same result shape as fetch_stats, with stats['items'] held as Columns
+    meta = {}
+    try:
+        items = await collect(stream_stats(start_date, end_date, domain, placement, group_by, meta))
+    except Exception as e:
+        logger.warning("Streamed stats request failed: %s", e)
+        return None
+
+    meta['items'] = items
+    return meta
+
+async def _fetch_items(url, label):
+    # None on failure, so callers can tell "no items" from "API down"
+    try:
+        resp = await _send("GET", url, headers=_headers())
+        if resp.status_code == 200:
+            data = resp.json()
+            return data.get("items", [])
+        logger.warning("%s API error: %s - %s", label, resp.status_code, resp.text)
+    except Exception as e:
+        logger.warning("%s API error: %s", label, e)
+
+    return None
+
+async def fetch_domains():
+    return await _fetch_items("/domains.json", "Domains")
+
+async def fetch_placements(domain_id):
+    return await _fetch_items(f"/domain/{domain_id}/placements.json", "Placements")
+
+async def get_stats_breakdown(start_date, end_date, targets, group_by="date", concurrency=FANOUT_CONCURRENCY):
+    # targets: [(domain, placement), ...], fetched concurrently under a semaphore.
+    # Items come back tagged with their domain/placement, failures are listed
+    # in "failed" instead of failing the whole report.
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(domain, placement):
+        async with semaphore:
+            return await get_stats(start_date, end_date, domain, placement, group_by)
+
+    results = await asyncio.gather(
+        *(fetch(domain, placement) for domain, placement in targets),
+        return_exceptions=True
+    )
+
+    items = []
+    failed = []
+    for (domain, placement), stats in zip(targets, results):
+        if isinstance(stats, Exception) or not stats:
+            failed.append({"domain": domain, "placement": placement})
+            continue
+        for item in stats.get("items") or []:
+            items.append({**item, "domain": domain, "placement": placement})
+
+    return {"items": items, "failed": failed, "requests": len(targets)}
 
 def calculate_summary(stats):
     summary = {
@@ -70,18 +244,7 @@ def calculate_summary(stats):
             "cpm": stats.get("cpm", 0),
         }
 
-    total_revenue = sum(float(item.get("revenue", 0) or 0) for item in items)
-    total_impression = sum(int(item.get("impression", 0) or 0) for item in items)
-    total_clicks = sum(int(item.get("clicks", 0) or 0) for item in items)
-    
-    summary['revenue'] = total_revenue
-    summary['impression'] = total_impression
-    summary['clicks'] = total_clicks
-    
-    if total_impression > 0:
-        summary['ctr'] = (total_clicks / total_impression) * 100
-        summary['cpm'] = (total_revenue / total_impression) * 1000
-    
+    summary.update(summarize(Columns.from_items(items, dims=())))
     return summary
 
 def format_summary(summary, start_date=None, end_date=None):
@@ -103,30 +266,49 @@ def format_stats(stats, group_by):
     if not stats or 'items' not in stats or not stats['items']:
         return "No data available for the selected filters."
     
-    items = stats['items']
-    message = ""
-    
+    return "".join(format_entry(item, group_by) for item in stats['items'])
+
+def format_entry(item, group_by):
+    return (
+        f"\n{format_group_label(item, group_by)}\n"
+        f"Impressions: {item.get('impression', 0):,}\n"
+        f"Clicks: {item.get('clicks', 0):,}\n"
+        f"CTR: {item.get('ctr', 0):.2f}%\n"
+        f"CPM: ${float(item.get('cpm', 0)):.3f}\n"
+        f"Earnings: ${float(item.get('revenue', 0)):.3f}\n"
+    )
+
+def count_pages(stats, per_page=REPORT_PAGE_SIZE):
+    if not stats or not stats.get('items'):
+        return 1
+    return (len(stats['items']) + per_page - 1) // per_page
+
+def format_stats_page(stats, group_by, page, per_page=REPORT_PAGE_SIZE):
+    # Only the entries of the requested page are rendered. Pages always break
+    # between entries, and per_page keeps them under Telegram's 4096 chars.
+    if not stats or 'items' not in stats or not stats['items']:
+        return "No data available for the selected filters."
+
+    start = page * per_page
+    return "".join(format_entry(item, group_by) for item in stats['items'][start:start + per_page])
+
+def format_group_label(item, group_by):
+    # Domain and placement names are free text from the API, and pages are
+    # sent as Markdown
     if group_by == 'date':
-        for item in items:
-            date = item.get('date', 'N/A')
-            message += (
-                f"\n📅 {date}\n"
-                f"Impressions: {item.get('impression', 0):,}\n"
-                f"Clicks: {item.get('clicks', 0):,}\n"
-                f"CTR: {item.get('ctr', 0):.2f}%\n"
-                f"CPM: ${float(item.get('cpm', 0)):.3f}\n"
-                f"Earnings: ${float(item.get('revenue', 0)):.3f}\n"
-            )
+        return f"📅 {item.get('date', 'N/A')}"
+    elif group_by == 'week':
+        return f"🗓 Week of {item.get('week', 'N/A')}"
+    elif group_by == 'month':
+        return f"🗓 {item.get('month', 'N/A')}"
+    elif group_by == 'domain':
+        # catalog imports this module, so it is looked up lazily
+        from catalog import domain_name
+        domain = item.get('domain')
+        return f"🌐 {escape_markdown(str(domain_name(domain, domain or 'N/A')))}"
+    elif group_by == 'placement':
+        placement = item.get('placement')
+        name = item.get('placement_name') or f'Placement {placement}'
+        return f"🎯 {escape_markdown(str(name)[:64])}"
     else:  # country
-        for item in items:
-            country = item.get('country', 'N/A')
-            message += (
-                f"\n🌍 {country}\n"
-                f"Impressions: {item.get('impression', 0):,}\n"
-                f"Clicks: {item.get('clicks', 0):,}\n"
-                f"CTR: {item.get('ctr', 0):.2f}%\n"
-                f"CPM: ${float(item.get('cpm', 0)):.3f}\n"
-                f"Earnings: ${float(item.get('revenue', 0)):.3f}\n"
-            )
-    
-    return message
+        return f"🌍 {item.get('country', 'N/A')}"
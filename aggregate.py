@@ -0,0 +1,173 @@
+from array import array
+from datetime import date, timedelta
+from functools import lru_cache
+
+# Dimensions stored as plain columns next to the typed metric arrays
+DIMENSIONS = ('date', 'country', 'domain', 'placement')
+
+@lru_cache(maxsize=4096)
+def week_of(day):
+    # Monday of the ISO week, e.g. "2024-01-01"
+    if not day:
+        return None
+    d = date.fromisoformat(day)
+    return (d - timedelta(days=d.weekday())).isoformat()
+
+@lru_cache(maxsize=4096)
+def month_of(day):
+    return day[:7] if day else None
+
+# Groupings derived from a stored column
+DERIVED = {
+    'week': ('date', week_of),
+    'month': ('date', month_of),
+}
+
+def _number(value, cast):
+    try:
+        return cast(value or 0)
+    except (TypeError, ValueError):
+        return cast(0)
+
+class Columns:
+    # Stats items parsed once into columns: revenue as doubles, impressions and
+    # clicks as 64-bit ints, dimensions as lists. Every summary and group-by
+    # afterwards works on these without touching the original dicts again.
+
+    __slots__ = ('revenue', 'impression', 'clicks', 'dims', 'extra')
+
+    def __init__(self, dims=DIMENSIONS):
+        self.revenue = array('d')
+        self.impression = array('q')
+        self.clicks = array('q')
+        self.dims = {name: [] for name in dims}
+        # Optional per-row labels, e.g. placement_name
+        self.extra = {}
+
+    def __len__(self):
+        return len(self.revenue)
+
+    # Columns can stand in for the stats['items'] list: rows are rebuilt lazily
+    def row(self, index):
+        impression = self.impression[index]
+        clicks = self.clicks[index]
+        revenue = self.revenue[index]
+        item = {name: column[index] for name, column in self.dims.items() if column[index] is not None}
+        item.update(_row(impression, clicks, revenue))
+        if 'placement' in item and item['placement'] in self.extra:
+            item['placement_name'] = self.extra[item['placement']]
+        return item
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.row(index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.row(i) for i in range(*index.indices(len(self)))]
+        return self.row(index)
+
+    def append(self, item):
+        self.revenue.append(_number(item.get('revenue'), float))
+        self.impression.append(_number(item.get('impression'), int))
+        self.clicks.append(_number(item.get('clicks'), int))
+        for name, column in self.dims.items():
+            column.append(item.get(name))
+        if 'placement_name' in item:
+            self.extra[item.get('placement')] = item['placement_name']
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+        return self
+
+    @classmethod
+    def from_items(cls, items, dims=DIMENSIONS):
+        # dims=() skips the dimension columns when only totals are needed
+        if isinstance(items, Columns):
+            return items
+        if not isinstance(items, list):
+            return cls(dims).extend(items)
+
+        # Bulk path: one comprehension per column is far cheaper than append()
+        columns = cls(dims)
+        try:
+            columns.revenue = array('d', [float(item.get('revenue') or 0) for item in items])
+            columns.impression = array('q', [int(item.get('impression') or 0) for item in items])
+            columns.clicks = array('q', [int(item.get('clicks') or 0) for item in items])
+        except (TypeError, ValueError):
+            # Malformed numbers somewhere, take the per-item path that zeroes them
+            return cls(dims).extend(items)
+
+        for name in dims:
+            columns.dims[name] = [item.get(name) for item in items]
+        if 'placement' in dims and items and 'placement_name' in items[0]:
+            for item in items:
+                columns.extra[item.get('placement')] = item.get('placement_name')
+
+        return columns
+
+    def column(self, by):
+        if by in DERIVED and by not in self.dims:
+            source, derive = DERIVED[by]
+            return [derive(value) for value in self.dims[source]]
+        return self.dims[by]
+
+async def collect(items, dims=DIMENSIONS):
+    # Fold an async stream of items into columns without keeping the dicts
+    columns = Columns(dims)
+    async for item in items:
+        columns.append(item)
+    return columns
+
+def _row(impression, clicks, revenue):
+    return {
+        'impression': impression,
+        'clicks': clicks,
+        'ctr': (clicks / impression) * 100 if impression else 0,
+        'cpm': (revenue / impression) * 1000 if impression else 0,
+        'revenue': revenue,
+    }
+
+def summarize(columns):
+    # sum() over array objects runs without creating per-item Python objects
+    return _row(sum(columns.impression), sum(columns.clicks), sum(columns.revenue))
+
+def group(columns, by, order=None):
+    keys = columns.column(by)
+    acc = {}
+    for key, impression, clicks, revenue in zip(keys, columns.impression, columns.clicks, columns.revenue):
+        totals = acc.get(key)
+        if totals is None:
+            acc[key] = [impression, clicks, revenue]
+        else:
+            totals[0] += impression
+            totals[1] += clicks
+            totals[2] += revenue
+
+    rows = []
+    for key, (impression, clicks, revenue) in acc.items():
+        row = {by: key, **_row(impression, clicks, revenue)}
+        if by == 'placement' and key in columns.extra:
+            row['placement_name'] = columns.extra[key]
+        rows.append(row)
+
+    # Time buckets read chronologically, everything else by earnings
+    if (order or ('key' if by in ('date', 'week', 'month') else 'revenue')) == 'key':
+        rows.sort(key=lambda row: row[by] or '')
+    else:
+        rows.sort(key=lambda row: row['revenue'], reverse=True)
+    return rows
+
+def merge(parts, by):
+    # Rows of the same grouping from partial results over adjacent ranges,
+    # e.g. warehouse days plus the live tail; keys in both are summed
+    columns = Columns(dims=(by,))
+    for items in parts:
+        columns.extend(items)
+    return group(columns, by)
+
+def aggregate(items, group_by=()):
+    # One parse, then totals plus any number of group-bys
+    columns = items if isinstance(items, Columns) else Columns.from_items(items)
+    return summarize(columns), {by: group(columns, by) for by in group_by}
@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+from telegram.helpers import escape_markdown
+
+import catalog
+import tenants
+from config import ALERT_INTERVAL, ALERT_MAX_WINDOW, FANOUT_CONCURRENCY
+from state import backend
+from reports import load_stats
+from warehouse import MUTABLE_DAYS
+
+logger = logging.getLogger(__name__)
+
+METRICS = ('revenue', 'impression', 'clicks', 'cpm', 'ctr')
+# Totals that grow during the day; cpm and ctr are ratios
+ADDITIVE = ('revenue', 'impression', 'clicks')
+KINDS = ('drop', 'below')
+
+DEFAULT_WINDOW = 7
+
+EMPTY = {'impression': 0, 'clicks': 0, 'revenue': 0.0}
+
+# (tenant, domain, placement) -> {day: totals} for the last ALERT_MAX_WINDOW
+# days and today. Shared by every rule on the same query.
+series = {}
+
+def parse_rule(args):
+    # "cpm drop 30 [7]"          -> CPM 30% under its 7-day average
+    # "revenue below 50 [by 18]" -> revenue under $50 from 18:00 on
+    args = [arg.lower().lstrip('$').rstrip('%') for arg in args if arg.lower() != 'by']
+    if len(args) < 3 or args[0] not in METRICS or args[1] not in KINDS:
+        return None
+    metric, kind = args[0], args[1]
+    try:
+        threshold = float(args[2])
+        if len(args) > 3:
+            param = int(args[3].split(':')[0])
+        else:
+            param = DEFAULT_WINDOW if kind == 'drop' else 0
+    except ValueError:
+        return None
+
+    if kind == 'drop' and not (0 < threshold < 100 and 1 <= param <= ALERT_MAX_WINDOW):
+        return None
+    if kind == 'below' and not (threshold >= 0 and 0 <= param <= 23):
+        return None
+    return {'metric': metric, 'kind': kind, 'threshold': threshold, 'param': param}
+
+def format_value(metric, value):
+    if metric in ('revenue', 'cpm'):
+        return f"${value:,.2f}"
+    if metric == 'ctr':
+        return f"{value:.2f}%"
+    return f"{value:,.0f}"
+
+def target_name(domain, placement):
+    # Domain names of the active tenant, escaped for Markdown messages
+    name = catalog.domain_name(domain, str(domain)) if domain else 'All Domains'
+    target = escape_markdown(str(name))
+    if placement:
+        target += f" / Placement {placement}"
+    return target
+
+def describe(rule):
+    metric = rule['metric'].upper() if rule['metric'] in ('cpm', 'ctr') else rule['metric'].capitalize()
+    if rule['kind'] == 'drop':
+        condition = f"{rule['threshold']:g}% below its {rule['param']}-day average"
+    else:
+        condition = f"under {format_value(rule['metric'], rule['threshold'])}"
+        if rule['param']:
+            condition += f" by {rule['param']:02d}:00"
+    return f"{metric} for {target_name(rule['domain'], rule['placement'])} {condition}"
+
+def metric_value(totals, metric):
+    impression = totals['impression']
+    if metric == 'cpm':
+        return totals['revenue'] / impression * 1000 if impression else None
+    if metric == 'ctr':
+        return totals['clicks'] / impression * 100 if impression else None
+    return totals[metric]
+
+def baseline(days, today, window, metric):
+    # Average day of the `window` days before today; missing days count as empty
+    totals = dict(EMPTY)
+    for offset in range(1, window + 1):
+        day = days.get((today - timedelta(days=offset)).isoformat())
+        if day:
+            for field in totals:
+                totals[field] += day[field]
+    value = metric_value(totals, metric)
+    if value is not None and metric in ADDITIVE:
+        value /= window
+    return value
+
+def day_fraction(now):
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return (now - midnight).total_seconds() / 86400
+
+async def poll(key, today):
+    # The first poll loads the whole window, later ones only the days that can
+    # still change; older days stay as they are and age out of the window
+    tenant_id, domain, placement = key
+    tenant = tenants.get(tenant_id)
+    if tenant is None:
+        return False
+    first = today - timedelta(days=ALERT_MAX_WINDOW)
+    days = series.get(key)
+    start = first if days is None else today - timedelta(days=MUTABLE_DAYS - 1)
+
+    with tenants.using(tenant):
+        stats = await load_stats(start.isoformat(), today.isoformat(), domain, placement, 'date', refresh=True)
+    if stats is None:
+        return False
+
+    days = dict(days or {})
+    for item in stats.get('items') or []:
+        days[str(item.get('date'))] = {
+            'impression': int(item.get('impression', 0) or 0),
+            'clicks': int(item.get('clicks', 0) or 0),
+            'revenue': float(item.get('revenue', 0) or 0),
+        }
+    series[key] = {day: totals for day, totals in days.items() if day >= first.isoformat()}
+    return True
+
+def evaluate(rule, days, now, baselines):
+    # -> ('firing' or 'ok', current value, reference value), or None when there
+    # isn't enough data to tell and the rule keeps its state
+    today = now.date()
+    metric = rule['metric']
+    current = metric_value(days.get(today.isoformat(), EMPTY), metric)
+    if current is None:
+        return None
+
+    if rule['kind'] == 'below':
+        if now.hour < rule['param']:
+            return 'ok', current, rule['threshold']
+        return ('firing' if current < rule['threshold'] else 'ok'), current, rule['threshold']
+
+    key = (rule['param'], metric)
+    if key not in baselines:
+        baselines[key] = baseline(days, today, rule['param'], metric)
+    reference = baselines[key]
+    if not reference:
+        return None
+    if metric in ADDITIVE:
+        # Today so far against the same share of an average day; the first
+        # hour is too noisy to judge
+        if day_fraction(now) < 1 / 24:
+            return None
+        reference *= day_fraction(now)
+
+    drop = (1 - current / reference) * 100
+    return ('firing' if drop >= rule['threshold'] else 'ok'), current, reference
+
+def notification(rule, state, current, reference):
+    metric = rule['metric']
+    if rule['kind'] == 'drop':
+        detail = (f"{format_value(metric, current)} today vs {format_value(metric, reference)} "
+                  f"expected from the {rule['param']}-day average")
+    else:
+        detail = f"{format_value(metric, current)} today"
+    if state == 'firing':
+        return f"🚨 *Alert #{rule['id']}*: {describe(rule)}\n\n{detail}"
+    return f"✅ *Alert #{rule['id']} resolved*: {describe(rule)}\n\n{detail}"
+
+async def check_alerts(sender, now=None):
+    now = now or datetime.now()
+    today = now.date()
+    rules = await backend.get_alert_rules()
+
+    # Only rules whose owner is still logged in to the rule's tenant
+    owners = {}
+    for rule in rules:
+        if rule['user_id'] not in owners:
+            tenant = tenants.for_session(await backend.get_user_session(rule['user_id']))
+            owners[rule['user_id']] = tenant.id if tenant else None
+    active_rules = [rule for rule in rules if owners[rule['user_id']] == rule['tenant_id']]
+
+    # Every distinct query is polled once, however many rules watch it
+    groups = {}
+    for rule in active_rules:
+        groups.setdefault((rule['tenant_id'], rule['domain'], rule['placement']), []).append(rule)
+    for key in set(series) - set(groups):
+        del series[key]
+
+    semaphore = asyncio.Semaphore(FANOUT_CONCURRENCY)
+
+    async def load(key):
+        async with semaphore:
+            return await poll(key, today)
+
+    polled = await asyncio.gather(*(load(key) for key in groups))
+
+    changes = 0
+    for (key, group_rules), ok in zip(groups.items(), polled):
+        if not ok:
+            logger.warning("Skipping %d alert(s) for %s: no data", len(group_rules), key)
+            continue
+
+        tenant = tenants.get(key[0])
+        if tenant is None:
+            continue
+        baselines = {}
+        with tenants.using(tenant):
+            for rule in group_rules:
+                result = evaluate(rule, series[key], now, baselines)
+                if result is None:
+                    continue
+                state, current, reference = result
+
+                # "below" rules start every day afresh, without a resolved message
+                previous = rule['state']
+                if rule['kind'] == 'below' and rule['state_day'] != today.isoformat():
+                    previous = 'ok'
+                if state == previous and rule['state_day'] == today.isoformat():
+                    continue
+
+                await backend.set_alert_state(rule['id'], state, today.isoformat())
+                if state != previous:
+                    sender.send_message(rule['chat_id'], notification(rule, state, current, reference),
+                                        parse_mode='Markdown')
+                    changes += 1
+
+    logger.info("Checked %d alert rule(s) over %d query(ies), %d state change(s)",
+                len(active_rules), len(groups), changes)
+    return changes
+
+async def run_alerts(sender):
+    # Every ALERT_INTERVAL seconds, on one worker only
+    tick = int(time.time() // ALERT_INTERVAL)
+    if not await backend.acquire_lock(f"alerts:{tick}", ALERT_INTERVAL):
+        return
+    await check_alerts(sender)
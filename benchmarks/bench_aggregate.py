@@ -0,0 +1,82 @@
+# Compare calculate_summary/grouping against the original per-item implementation.
+#
+#   python benchmarks/bench_aggregate.py [rows]
+
+import os
+import random
+import sys
+import timeit
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aggregate import Columns, aggregate, group, summarize
+
+COUNTRIES = [f"C{i:02d}" for i in range(50)]
+PLACEMENTS = [101, 102, 103]
+
+def make_items(rows):
+    # Country x day x placement rows as the stats.json API returns them
+    start = date(2024, 1, 1)
+    items = []
+    while len(items) < rows:
+        day = start + timedelta(days=len(items) // (len(COUNTRIES) * len(PLACEMENTS)) % 366)
+        impression = random.randint(0, 50000)
+        items.append({
+            "date": day.isoformat(),
+            "country": random.choice(COUNTRIES),
+            "placement": random.choice(PLACEMENTS),
+            "impression": impression,
+            "clicks": impression // 100,
+            "ctr": 1.0,
+            "cpm": "0.512",
+            "revenue": str(round(impression * 0.0005, 4)),
+        })
+    return items
+
+def legacy_summary(items):
+    total_revenue = sum(float(item.get("revenue", 0) or 0) for item in items)
+    total_impression = sum(int(item.get("impression", 0) or 0) for item in items)
+    total_clicks = sum(int(item.get("clicks", 0) or 0) for item in items)
+    return total_revenue, total_impression, total_clicks
+
+def legacy_group(items, by):
+    rows = {}
+    for item in items:
+        row = rows.setdefault(item.get(by), {"impression": 0, "clicks": 0, "revenue": 0.0})
+        row["impression"] += int(item.get("impression", 0) or 0)
+        row["clicks"] += int(item.get("clicks", 0) or 0)
+        row["revenue"] += float(item.get("revenue", 0) or 0)
+    return rows
+
+def bench(label, func, number):
+    seconds = timeit.timeit(func, number=number) / number
+    print(f"{label:<42} {seconds * 1000:9.2f} ms")
+    return seconds
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 54750
+    items = make_items(rows)
+    columns = Columns.from_items(items)
+    number = 5
+
+    print(f"{rows:,} rows, mean of {number} runs\n")
+    bench("legacy: summary (3 passes)", lambda: legacy_summary(items), number)
+    bench("legacy: summary + date + country", lambda: (
+        legacy_summary(items), legacy_group(items, "date"), legacy_group(items, "country")
+    ), number)
+    bench("columns: parse totals only", lambda: summarize(Columns.from_items(items, dims=())), number)
+    bench("columns: parse", lambda: Columns.from_items(items), number)
+    bench("columns: summary (parsed)", lambda: summarize(columns), number)
+    bench("columns: date + week + month + country", lambda: [
+        group(columns, by) for by in ("date", "week", "month", "country")
+    ], number)
+    bench("columns: parse + summary + date + country", lambda: aggregate(items, ("date", "country")), number)
+
+    legacy = legacy_summary(items)
+    summary = summarize(columns)
+    assert abs(legacy[0] - summary["revenue"]) < 1e-6 * max(1, legacy[0])
+    assert (legacy[1], legacy[2]) == (summary["impression"], summary["clicks"])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# Bot API transport that never leaves the process: every call is recorded and
+# answered with a minimal valid result, optionally after a simulated latency.
+
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+
+from telegram.request import BaseRequest
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+class FakeTelegramRequest(BaseRequest):
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.sent = []  # (monotonic time, method, chat_id)
+        self.paged_messages = {}  # chat_id -> message_id of the last report with Prev/Next
+        self._message_ids = itertools.count(1000)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        chat_id = params.get("chat_id")
+        self.sent.append((time.monotonic(), endpoint, chat_id))
+
+        if endpoint == "getMe":
+            result = BOT_USER
+        elif endpoint in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+            message_id = params.get("message_id") or next(self._message_ids)
+            result = {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+            if "page_" in json.dumps(params.get("reply_markup") or {}):
+                self.paged_messages[chat_id] = message_id
+        elif endpoint == "sendPhoto":
+            message_id = next(self._message_ids)
+            result = {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "photo": [{"file_id": f"photo{message_id}", "file_unique_id": f"u{message_id}",
+                           "width": 880, "height": 495}],
+            }
+        elif endpoint == "sendDocument":
+            message_id = next(self._message_ids)
+            result = {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "document": {"file_id": f"doc{message_id}", "file_unique_id": f"u{message_id}"},
+            }
+        else:
+            result = True
+
+        return 200, json.dumps({"ok": True, "result": result}).encode()
@@ -0,0 +1,199 @@
+# Offline load test: scripted users tap through the bot against a mock Adsterra
+# API and a fake Telegram transport, nothing leaves the process.
+#
+#   python benchmarks/loadtest.py --users 200 --concurrency 50 --latency 0.08 --error-rate 0.02
+#
+# Reports throughput, tap-to-reply latency percentiles (from submitting the
+# update until its handler has sent every reply), upstream and Bot API call
+# counts and peak RSS. The bot's own settings (ADSTERRA_RATE_LIMIT, cache
+# sizes, ...) are read from the environment as usual.
+
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Throwaway databases, set before the bot modules read their config
+_tmp = tempfile.mkdtemp(prefix="adsterra-bench-")
+os.environ["DB_PATH"] = os.path.join(_tmp, "sessions.db")
+os.environ["WAREHOUSE_DB"] = os.path.join(_tmp, "stats.db")
+os.environ["STATE_BACKEND"] = "sqlite"
+os.environ.setdefault("BOT_TOKEN", "123456:BENCH")
+os.environ.setdefault("ADSTERRA_API_KEY", "bench")
+
+from telegram import Update
+from telegram.ext import Application
+
+import adsterra_api
+import bot
+import catalog
+import tenants
+import warehouse
+from config import USER_DB
+from fake_telegram import BOT_USER, FakeTelegramRequest
+from mock_adsterra import MockAdsterra
+
+_update_ids = itertools.count(1)
+
+def message_update(application, user_id, text):
+    entities = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}] if text.startswith("/") else []
+    return Update.de_json({
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_update_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "text": text,
+            "entities": entities,
+        },
+    }, application.bot)
+
+def callback_update(application, user_id, data, message_id=1):
+    return Update.de_json({
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": BOT_USER,
+                "text": "menu",
+            },
+        },
+    }, application.bot)
+
+def session_script():
+    # (label, kind, payload) steps of one user session
+    username, password = next(iter(USER_DB.items()))
+    today = date.today()
+    custom = f"{(today - timedelta(days=13)).isoformat()} to {(today - timedelta(days=1)).isoformat()}"
+    return [
+        ("start", "message", "/start"),
+        ("login", "message", f"{username}|{password}"),
+        ("report_today", "callback", "report_today"),
+        ("date_filter", "callback", "date_filter"),
+        ("preset_last7", "callback", "preset_last7"),
+        ("preset_last30", "callback", "preset_last30"),
+        ("toggle_group", "callback", "toggle_group"),
+        ("next_page", "page", 1),
+        ("preset_custom", "callback", "preset_custom"),
+        ("custom_range", "message", custom),
+        ("preset_thisyear", "callback", "preset_thisyear"),
+        ("reset_filters", "callback", "reset_filters"),
+    ]
+
+async def run_session(application, telegram, user_id, latencies, think):
+    for label, kind, payload in session_script():
+        if kind == "message":
+            update = message_update(application, user_id, payload)
+        elif kind == "page":
+            message_id = telegram.paged_messages.get(user_id)
+            if message_id is None:
+                continue
+            update = callback_update(application, user_id, f"page_{payload}", message_id)
+        else:
+            update = callback_update(application, user_id, payload)
+
+        started = time.perf_counter()
+        await application.process_update(update)
+        latencies[label].append(time.perf_counter() - started)
+        if think:
+            await asyncio.sleep(think)
+
+def percentiles(values):
+    if len(values) < 2:
+        value = values[0] if values else 0.0
+        return value, value, value
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return cuts[49], cuts[94], cuts[98]
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+async def main(args):
+    api = MockAdsterra(
+        latency=args.latency,
+        jitter=args.latency / 3,
+        error_rate=args.error_rate,
+        countries=args.countries,
+        placements=args.placements
+    )
+    telegram = FakeTelegramRequest(latency=args.telegram_latency)
+
+    application = bot.build_application(
+        Application.builder().request(telegram).get_updates_request(FakeTelegramRequest())
+    )
+    adsterra_api.init_client(transport=api.transport())
+    await application.initialize()
+    await tenants.load()
+    await catalog.refresh()
+
+    latencies = defaultdict(list)
+    sessions = asyncio.Semaphore(args.concurrency)
+
+    async def user(user_id):
+        async with sessions:
+            for _ in range(args.rounds):
+                await run_session(application, telegram, user_id, latencies, args.think)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(10_000 + i) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+
+    await application.shutdown()
+    await adsterra_api.close_client()
+    await bot.backend.close()
+    warehouse.close_warehouse()
+    shutil.rmtree(_tmp, ignore_errors=True)
+
+    taps = [value for values in latencies.values() for value in values]
+    p50, p95, p99 = percentiles(taps)
+    print(f"users={args.users} concurrency={args.concurrency} rounds={args.rounds} "
+          f"api_latency={args.latency * 1000:.0f}ms error_rate={args.error_rate:.0%}")
+    print(f"updates: {len(taps)} in {elapsed:.2f}s = {len(taps) / elapsed:.1f} updates/s")
+    print(f"tap-to-reply: p50 {p50 * 1000:.1f} ms  p95 {p95 * 1000:.1f} ms  p99 {p99 * 1000:.1f} ms")
+    print()
+    print(f"{'step':<16} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for label, values in latencies.items():
+        p50, p95, p99 = percentiles(values)
+        print(f"{label:<16} {len(values):>6} {p50 * 1000:>9.1f} {p95 * 1000:>9.1f} {p99 * 1000:>9.1f}")
+    print()
+    print(f"upstream calls: {sum(api.calls.values())} {dict(api.calls)} "
+          f"(errors injected: {api.errors}, rows served: {api.rows}, peak in flight: {api.peak_in_flight})")
+    print(f"stats cache: {adsterra_api.stats_cache.stats()}")
+    print(f"bot api calls: {sum(telegram.calls.values())} {dict(telegram.calls)}")
+    print(f"peak RSS: {peak_rss_mb():.1f} MB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=20, help="sessions running at the same time")
+    parser.add_argument("--rounds", type=int, default=1, help="times each user repeats the script")
+    parser.add_argument("--think", type=float, default=0.0, help="seconds between taps of one user")
+    parser.add_argument("--latency", type=float, default=0.05, help="mean Adsterra API latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of API calls answered 429/500")
+    parser.add_argument("--countries", type=int, default=20, help="countries per day in country reports")
+    parser.add_argument("--placements", type=int, default=15, help="placements per domain")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="simulated Bot API latency in seconds")
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(main(parser.parse_args()))
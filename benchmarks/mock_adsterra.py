@@ -0,0 +1,104 @@
+# In-process stand-in for api3.adsterratools.com, mounted with
+# adsterra_api.init_client(transport=MockAdsterra(...).transport()).
+
+import asyncio
+import random
+from collections import Counter
+from datetime import date, timedelta
+
+import httpx
+
+class MockAdsterra:
+    def __init__(self, latency=0.05, jitter=0.02, error_rate=0.0, countries=20, domains=2,
+                 placements=15, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.countries = [f"C{i:02d}" for i in range(countries)]
+        self.domains = {1000 + i: f"site{i}.example" for i in range(domains)}
+        self.placements = {
+            domain_id: [domain_id * 100 + i for i in range(placements)]
+            for domain_id in self.domains
+        }
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.errors = 0
+        self.rows = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def transport(self):
+        return httpx.MockTransport(self.handle)
+
+    async def handle(self, request):
+        path = request.url.path.rsplit("/publisher", 1)[-1]
+        endpoint = "/domain/placements.json" if path.startswith("/domain/") else path
+        self.calls[endpoint] += 1
+
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(max(0.0, self.random.gauss(self.latency, self.jitter)))
+        finally:
+            self.in_flight -= 1
+
+        if self.random.random() < self.error_rate:
+            self.errors += 1
+            if self.random.random() < 0.5:
+                return httpx.Response(429, headers={"Retry-After": "1"}, json={"message": "Too many requests"})
+            return httpx.Response(500, json={"message": "Internal error"})
+
+        if endpoint == "/domains.json":
+            items = [{"id": domain_id, "title": title} for domain_id, title in self.domains.items()]
+        elif endpoint == "/domain/placements.json":
+            domain_id = int(path.split("/")[2])
+            items = [
+                {"id": placement_id, "alias": f"Placement {placement_id}"}
+                for placement_id in self.placements.get(domain_id, [])
+            ]
+        elif endpoint == "/stats.json":
+            items = self.stats(request.url.params)
+        else:
+            return httpx.Response(404, json={"message": "Not found"})
+
+        self.rows += len(items)
+        return httpx.Response(200, json={"items": items})
+
+    def stats(self, params):
+        dims = params.get_list("group_by[]") or [params.get("group_by", "date")]
+        start = date.fromisoformat(params["start_date"])
+        end = date.fromisoformat(params["finish_date"])
+        domains = [int(params["domain"])] if params.get("domain") else list(self.domains)
+
+        # Every combination of the requested dimensions gets a row
+        rows = [{}]
+        for dim in dims:
+            if dim == "date":
+                values = [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+            elif dim == "country":
+                values = self.countries
+            elif dim == "domain":
+                values = domains
+            elif dim == "placement":
+                if params.get("placement"):
+                    values = [int(params["placement"])]
+                else:
+                    values = [p for domain_id in domains for p in self.placements.get(domain_id, [])]
+            else:
+                values = [None]
+            rows = [{**row, dim: value} for row in rows for value in values]
+
+        items = []
+        for row in rows:
+            impression = self.random.randint(100, 50000)
+            clicks = impression // self.random.randint(50, 200)
+            revenue = round(impression * self.random.uniform(0.0002, 0.002), 4)
+            items.append({
+                **row,
+                "impression": impression,
+                "clicks": clicks,
+                "ctr": round(clicks / impression * 100, 2),
+                "cpm": round(revenue / impression * 1000, 3),
+                "revenue": revenue,
+            })
+        return items
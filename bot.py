@@ -7,31 +7,69 @@ from telegram import (
     InlineKeyboardMarkup,
     ReplyKeyboardRemove
 )
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
+    ApplicationHandlerStop,
     CommandHandler,
     CallbackQueryHandler,
     MessageHandler,
+    TypeHandler,
     filters,
     ContextTypes,
     ConversationHandler
 )
-from datetime import datetime, timedelta
-from config import BOT_TOKEN, USER_DB, DOMAINS
-from database import (
-    get_user_session,
-    create_session,
-    delete_session,
-    update_user_filters,
-    get_user_filters
+from datetime import datetime
+import alerts
+import catalog
+import charts
+import digest
+import export
+import metrics
+import prewarm
+import scheduler
+import tenants
+import warehouse
+import webhook
+import webserver
+from cache import TTLCache
+from metrics import register_cache, timed_handler
+from ordering import OrderedApplication
+from persistence import BackendPersistence
+from sender import MessageSender
+from config import (
+    BOT_TOKEN,
+    BOT_MODE,
+    CONCURRENT_UPDATES,
+    METRICS_LISTEN,
+    METRICS_PORT,
+    LOOP_LAG_INTERVAL,
+    ADMIN_IDS,
+    ALERT_INTERVAL,
+    ALERT_MAX_PER_USER,
+    TENANT_REFRESH_INTERVAL,
+    WAREHOUSE_SYNC_INTERVAL,
+    USER_STATE_FLUSH_INTERVAL,
+    PREWARM_TICK,
+    SENDER_RATE,
+    SENDER_PER_CHAT_INTERVAL,
+    CATALOG_REFRESH_INTERVAL,
+    PLACEMENT_PAGE_SIZE,
+    REPORT_PAGES_CACHE_SIZE,
+    REPORT_PAGES_TTL
 )
+from state import backend
 from adsterra_api import (
-    get_stats,
-    get_placements,
+    init_client,
+    close_client,
+    stats_cache,
+    stats_cache_key,
     calculate_summary,
     format_summary,
-    format_stats
+    format_stats_page,
+    count_pages
 )
+from reports import load_stats, get_preset_dates
 
 # Enable logging
 logging.basicConfig(
@@ -43,37 +81,33 @@ logger = logging.getLogger(__name__)
 # Conversation states
 LOGIN, MAIN_MENU, DATE_FILTER, DOMAIN_FILTER, PLACEMENT_FILTER = range(5)
 
-# Helper functions
-def get_preset_dates(preset):
-    today = datetime.now().date()
-    
-    if preset == "today":
-        return today, today
-    elif preset == "yesterday":
-        yesterday = today - timedelta(days=1)
-        return yesterday, yesterday
-    elif preset == "last7":
-        return today - timedelta(days=6), today
-    elif preset == "last30":
-        return today - timedelta(days=29), today
-    elif preset == "thismonth":
-        start = today.replace(day=1)
-        return start, today
-    elif preset == "thisyear":
-        start = today.replace(month=1, day=1)
-        return start, today
-    else:
-        return today, today
+# Order of the "Group By" toggle
+GROUP_BY_CYCLE = ['date', 'week', 'month', 'country', 'domain', 'placement']
+
+# Queued sender for digests, created in post_init
+sender = None
 
-async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# Data behind each paginated report message, keyed by (chat_id, message_id)
+report_pages = TTLCache(maxsize=REPORT_PAGES_CACHE_SIZE, default_ttl=REPORT_PAGES_TTL)
+register_cache("report_pages", report_pages)
+metrics.CallbackGauge("sender_queue_pending", "Digest/alert messages waiting to be sent",
+                      lambda: sender.pending() if sender else 0)
+metrics_server = None
+
+async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, filters=None):
     user_id = update.effective_user.id
-    filters = get_user_filters(user_id) or {}
+    if filters is None:
+        filters = await backend.get_user_filters(user_id) or {}
 
     # Build menu with current filters
     start_date = filters.get('start_date', 'Today')
     end_date = filters.get('end_date', 'Today')
-    domain = DOMAINS.get(filters.get('domain'), 'All Domains')
-    placement = f"Placement {filters.get('placement')}" if filters.get('placement') else 'All Placements'
+    domain = catalog.domain_name(filters.get('domain'), 'All Domains')
+    if filters.get('placement'):
+        name = catalog.placement_name(filters.get('domain'), filters.get('placement'))
+        placement = name or f"Placement {filters.get('placement')}"
+    else:
+        placement = 'All Placements'
     group_by = filters.get('group_by', 'date').capitalize()
 
     keyboard = [
@@ -90,6 +124,9 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
             InlineKeyboardButton("🔄 Reset Filters", callback_data="reset_filters")
         ]
     ]
+    if charts.available:
+        view = "🖼 Chart" if context.user_data.get('view') == 'chart' else "📝 Text"
+        keyboard.append([InlineKeyboardButton(f"View: {view}", callback_data="toggle_view")])
 
     reply_markup = InlineKeyboardMarkup(keyboard)
     message_text = "📊 *Adsterra Dashboard* - Main Menu\n\nCurrent filters:"
@@ -123,32 +160,55 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 
-async def generate_report(update: Update, context: ContextTypes.DEFAULT_TYPE, start_date=None, end_date=None):
+async def generate_report(update: Update, context: ContextTypes.DEFAULT_TYPE, start_date=None, end_date=None, filters=None):
     user_id = update.effective_user.id
-    filters = get_user_filters(user_id) or {}
+    if filters is None:
+        filters = await backend.get_user_filters(user_id) or {}
     
     if not start_date or not end_date:
-        start_date = filters.get('start_date', datetime.now().date().isoformat())
-        end_date = filters.get('end_date', datetime.now().date().isoformat())
+        # Stored filters keep None for "no date chosen" (after a domain pick or a reset)
+        start_date = filters.get('start_date') or datetime.now().date().isoformat()
+        end_date = filters.get('end_date') or datetime.now().date().isoformat()
     
     domain = filters.get('domain')
     placement = filters.get('placement')
     group_by = filters.get('group_by', 'date')
     
-    # Get stats from API
-    stats = await get_stats(start_date, end_date, domain, placement, group_by)
+    # Get stats from the local warehouse or the API
+    stats = await load_stats(start_date, end_date, domain, placement, group_by)
     
     if not stats:
-        await update.callback_query.answer("Failed to fetch data from Adsterra API")
+        if tenants.active().breaker.state == "open":
+            message = "Adsterra API is unavailable right now, please try again in a minute"
+        else:
+            message = "Failed to fetch data from Adsterra API"
+        await update.callback_query.answer(message)
         return
     
     # Calculate and show summary
     summary = calculate_summary(stats)
     summary_text = format_summary(summary, start_date, end_date)
+    if stats.get('failed'):
+        summary_text += f"\n\n⚠️ {len(stats['failed'])} of {stats['requests']} breakdown requests failed"
     
-    # Show detailed stats
-    detailed_stats = format_stats(stats, group_by)
-    
+    # Chart mode: one photo with the summary as caption instead of text pages
+    if context.user_data.get('view') == 'chart' and charts.available:
+        try:
+            await charts.send_chart(
+                context.bot,
+                update.effective_chat.id,
+                stats_cache_key(start_date, end_date, domain, placement, group_by),
+                stats,
+                group_by,
+                title=f"{start_date} to {end_date} by {group_by}",
+                caption=f"📈 *Adsterra Report Summary*\n\n{summary_text}",
+                parse_mode='Markdown'
+            )
+            await show_main_menu(update, context, filters)
+            return
+        except Exception:
+            logger.exception("Chart rendering failed, falling back to text")
+
     # Send summary first
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
@@ -156,30 +216,138 @@ async def generate_report(update: Update, context: ContextTypes.DEFAULT_TYPE, st
         parse_mode='Markdown'
     )
     
-    # Then send detailed stats (split if too long)
-    if len(detailed_stats) > 4000:
-        parts = [detailed_stats[i:i+4000] for i in range(0, len(detailed_stats), 4000)]
-        for part in parts:
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=part,
-                parse_mode='Markdown'
-            )
-    else:
+    # Then the first page of detailed stats, further pages are rendered on demand
+    total_pages = count_pages(stats)
+    message = await context.bot.send_message(
+        chat_id=update.effective_chat.id,
+        text=format_stats_page(stats, group_by, 0),
+        reply_markup=page_keyboard(0, total_pages),
+        parse_mode='Markdown'
+    )
+    if total_pages > 1:
+        report_pages.set((message.chat_id, message.message_id), (stats, group_by))
+    
+    # Show menu again
+    await show_main_menu(update, context, filters)
+
+def page_keyboard(page, total_pages):
+    if total_pages <= 1:
+        return None
+
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("◀️ Prev", callback_data=f"page_{page - 1}"))
+    buttons.append(InlineKeyboardButton(f"{page + 1}/{total_pages}", callback_data=f"page_{page}"))
+    if page < total_pages - 1:
+        buttons.append(InlineKeyboardButton("Next ▶️", callback_data=f"page_{page + 1}"))
+    return InlineKeyboardMarkup([buttons])
+
+def placement_keyboard(items, page, per_page=PLACEMENT_PAGE_SIZE):
+    total_pages = max(1, -(-len(items) // per_page))
+    page = min(max(page, 0), total_pages - 1)
+
+    keyboard = [[InlineKeyboardButton("All Placements", callback_data="placement_all")]]
+    for placement in items[page * per_page:(page + 1) * per_page]:
+        placement_id = placement.get('id')
+        placement_name = placement.get('alias') or placement.get('title') or f"Placement {placement_id}"
+        keyboard.append([
+            InlineKeyboardButton(placement_name[:64], callback_data=f"placement_{placement_id}")
+        ])
+
+    if total_pages > 1:
+        buttons = []
+        if page > 0:
+            buttons.append(InlineKeyboardButton("◀️ Prev", callback_data=f"placements_{page - 1}"))
+        buttons.append(InlineKeyboardButton(f"{page + 1}/{total_pages}", callback_data=f"placements_{page}"))
+        if page < total_pages - 1:
+            buttons.append(InlineKeyboardButton("Next ▶️", callback_data=f"placements_{page + 1}"))
+        keyboard.append(buttons)
+
+    keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="back_to_menu")])
+    return InlineKeyboardMarkup(keyboard)
+
+async def show_placement_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, page):
+    query = update.callback_query
+    filters = await backend.get_user_filters(update.effective_user.id) or {}
+    domain_id = filters.get('domain')
+
+    if not domain_id:
+        await query.answer("Please select a domain first")
+        return
+
+    # Served from the catalog only, a cold domain is loaded in the background
+    placements = catalog.cached_placements(domain_id)
+    if placements is None:
+        catalog.load_placements(domain_id)
+        await query.answer("Placements are still loading, please try again in a moment")
+        return
+
+    if not placements:
+        await query.answer("No placements found for this domain")
+        return
+
+    await query.edit_message_text(
+        text=f"🎯 Select placement ({len(placements)} total):",
+        reply_markup=placement_keyboard(placements, page)
+    )
+
+async def show_report_page(update: Update, context: ContextTypes.DEFAULT_TYPE, page):
+    query = update.callback_query
+    report = report_pages.lookup((query.message.chat_id, query.message.message_id))
+
+    if report is None:
+        await query.edit_message_reply_markup(reply_markup=None)
         await context.bot.send_message(
             chat_id=update.effective_chat.id,
-            text=detailed_stats,
+            text="This report has expired, please run it again."
+        )
+        return
+
+    stats, group_by = report
+    total_pages = count_pages(stats)
+    page = max(0, min(page, total_pages - 1))
+    try:
+        await query.edit_message_text(
+            text=format_stats_page(stats, group_by, page),
+            reply_markup=page_keyboard(page, total_pages),
             parse_mode='Markdown'
         )
-    
-    # Show menu again
-    await show_main_menu(update, context)
+    except BadRequest as e:
+        # Tapping the current page indicator doesn't change anything
+        if "not modified" not in str(e):
+            raise
 
 # Command handlers
+@timed_handler()
+async def activate_tenant(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Runs before every other handler (group -1): reports, catalog and caches
+    # act on the tenant of the logged-in user for the rest of this update.
+    # Users without one get no tenant at all, never a default account's data.
+    if not update.effective_user:
+        return
+    user_id = update.effective_user.id
+    session = await backend.get_user_session(user_id)
+    tenant = tenants.for_session(session)
+    if tenant is None and session and session[4] is not None:
+        # Possibly added on another worker since our last refresh
+        await tenants.load()
+        tenant = tenants.for_session(session)
+
+    if tenant is not None:
+        tenants.activate(tenant)
+        return
+    if session:
+        # Its tenant was removed, the user has to log in again
+        await backend.delete_session(user_id)
+    if update.callback_query:
+        # Buttons left over from an earlier login
+        await update.callback_query.answer("🔒 Please /start and login again.", show_alert=True)
+        raise ApplicationHandlerStop
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logging.info(f"User {update.effective_user.id} started the bot.")
     user_id = update.effective_user.id
-    session = get_user_session(user_id)
+    session = await backend.get_user_session(user_id)
 
     if session:
         await update.message.reply_text(
@@ -198,6 +366,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     return ConversationHandler.END  # keluar dari conversation apapun
 
+@timed_handler()
 async def login(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info(f"[LOGIN] User {update.effective_user.id} trying to login.")
     user_id = update.effective_user.id
@@ -214,9 +383,18 @@ async def login(update: Update, context: ContextTypes.DEFAULT_TYPE):
     username = username.strip()
     password = password.strip()
     
-    if username in USER_DB and USER_DB[username] == password:
+    tenant_id = await tenants.authenticate(username, password)
+    tenant = None
+    if tenant_id is not None:
+        tenant = tenants.get(tenant_id)
+        if tenant is None:
+            # Added on another worker since our last refresh
+            await tenants.load()
+            tenant = tenants.get(tenant_id)
+    if tenant is not None:
         # Successful login
-        create_session(user_id, username)
+        await backend.create_session(user_id, username, tenant_id)
+        tenants.activate(tenant)
         await update.message.reply_text(
             f"✅ Login successful! Welcome, {username}.",
             reply_markup=ReplyKeyboardRemove()
@@ -232,15 +410,156 @@ async def login(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return LOGIN
 
+@timed_handler()
 async def logout(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    delete_session(user_id)
+    await backend.delete_session(user_id)
+    # Digests and alerts carry the tenant's numbers, they stop with the login
+    await backend.unsubscribe_digest(user_id)
+    for rule in await backend.get_alert_rules(user_id):
+        await backend.delete_alert_rule(user_id, rule['id'])
     await update.message.reply_text(
         "You have been logged out successfully.",
         reply_markup=ReplyKeyboardRemove()
     )
     return ConversationHandler.END
 
+@timed_handler()
+async def subscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    if not await backend.get_user_session(user_id):
+        await update.message.reply_text("🔒 Please /start and login first.")
+        return
+
+    frequency = context.args[0].lower() if context.args else 'daily'
+    if frequency not in digest.FREQUENCIES:
+        await update.message.reply_text(
+            "Usage: `/subscribe daily` or `/subscribe hourly`",
+            parse_mode='Markdown'
+        )
+        return
+
+    await backend.subscribe_digest(user_id, update.effective_chat.id, frequency)
+    await update.message.reply_text(
+        f"✅ Subscribed to the {frequency} digest. It uses your current domain and placement filters."
+    )
+
+@timed_handler()
+async def unsubscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    frequency = context.args[0].lower() if context.args else None
+    if frequency and frequency not in digest.FREQUENCIES:
+        await update.message.reply_text(
+            "Usage: `/unsubscribe`, `/unsubscribe daily` or `/unsubscribe hourly`",
+            parse_mode='Markdown'
+        )
+        return
+
+    await backend.unsubscribe_digest(update.effective_user.id, frequency)
+    await update.message.reply_text(
+        f"✅ Unsubscribed from {f'the {frequency} digest' if frequency else 'all digests'}."
+    )
+
+@timed_handler()
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    if not await backend.get_user_session(user_id):
+        await update.message.reply_text("🔒 Please /start and login first.")
+        return
+
+    fmt = context.args[0].lower() if context.args else 'csv'
+    if fmt not in export.FORMATS:
+        await update.message.reply_text(
+            "Usage: " + " or ".join(f"`/export {name}`" for name in export.FORMATS),
+            parse_mode='Markdown'
+        )
+        return
+
+    if user_id in export.running:
+        await update.message.reply_text("⏳ Your previous export is still running.")
+        return
+
+    # Runs in the background so this user's other updates aren't held up
+    export.running.add(user_id)
+    filters = await backend.get_user_filters(user_id) or {}
+    context.application.create_task(
+        export.run_export(context.bot, update.effective_chat.id, user_id, filters, fmt)
+    )
+
+ALERT_USAGE = (
+    "Usage:\n"
+    "`/alert cpm drop 30 7` - CPM 30% below its 7-day average\n"
+    "`/alert revenue below 50 by 18` - revenue under $50 by 18:00\n"
+    "`/alert delete 3` - remove alert #3\n\n"
+    "Metrics: " + ", ".join(alerts.METRICS) + ". Alerts use your current domain and placement filters."
+)
+
+@timed_handler()
+async def alert_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    if not await backend.get_user_session(user_id):
+        await update.message.reply_text("🔒 Please /start and login first.")
+        return
+
+    args = context.args or []
+    if len(args) == 2 and args[0].lower() == 'delete' and args[1].lstrip('#').isdigit():
+        if await backend.delete_alert_rule(user_id, int(args[1].lstrip('#'))):
+            await update.message.reply_text(f"✅ Alert #{args[1].lstrip('#')} deleted.")
+        else:
+            await update.message.reply_text("No such alert, see /alerts")
+        return
+
+    rule = alerts.parse_rule(args)
+    if rule is None:
+        await update.message.reply_text(ALERT_USAGE, parse_mode='Markdown')
+        return
+
+    if len(await backend.get_alert_rules(user_id)) >= ALERT_MAX_PER_USER:
+        await update.message.reply_text(f"You already have {ALERT_MAX_PER_USER} alerts, delete one first.")
+        return
+
+    filters = await backend.get_user_filters(user_id) or {}
+    rule.update(
+        user_id=user_id,
+        chat_id=update.effective_chat.id,
+        tenant_id=tenants.active().id,
+        domain=filters.get('domain'),
+        placement=filters.get('placement'),
+        state='ok'
+    )
+    rule['id'] = await backend.add_alert_rule(rule)
+    await update.message.reply_text(
+        f"✅ Alert #{rule['id']} created: {alerts.describe(rule)}.\n"
+        f"Checked every {ALERT_INTERVAL // 60} minutes, you'll hear when it fires and when it resolves.",
+        parse_mode='Markdown'
+    )
+
+@timed_handler()
+async def alerts_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await backend.get_user_session(update.effective_user.id):
+        await update.message.reply_text("🔒 Please /start and login first.")
+        return
+
+    rules = await backend.get_alert_rules(update.effective_user.id)
+    if not rules:
+        await update.message.reply_text(ALERT_USAGE, parse_mode='Markdown')
+        return
+
+    lines = [
+        f"{'🚨' if rule['state'] == 'firing' else '✅'} #{rule['id']}: {alerts.describe(rule)}"
+        for rule in rules
+    ]
+    await update.message.reply_text("Your alerts:\n\n" + "\n".join(lines), parse_mode='Markdown')
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+
+    text = metrics.summary()
+    if sender is not None:
+        text += f"\n\nSender queue: {sender.pending()} pending, {sender.sent} sent, {sender.failed} failed"
+    await update.message.reply_text(text)
+
+@timed_handler()
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         'Operation cancelled.',
@@ -249,6 +568,11 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 # Callback handlers
+def callback_label(update):
+    # "page_3" and "placement_123" are one handler each
+    return re.sub(r'_\d+$', '', update.callback_query.data or '')
+
+@timed_handler(callback_label)
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -256,7 +580,10 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     data = query.data
     
-    if data == 'report_today':
+    if data.startswith('page_'):
+        await show_report_page(update, context, int(data.split('_')[1]))
+
+    elif data == 'report_today':
         today = datetime.now().date().isoformat()
         await generate_report(update, context, today, today)
     
@@ -300,12 +627,12 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return DATE_FILTER
         else:
             start_date, end_date = get_preset_dates(preset)
-            update_user_filters(
+            filters = await backend.update_user_filters(
                 user_id,
                 start_date=start_date.isoformat(),
                 end_date=end_date.isoformat()
             )
-            await generate_report(update, context, start_date.isoformat(), end_date.isoformat())
+            await generate_report(update, context, start_date.isoformat(), end_date.isoformat(), filters)
             return MAIN_MENU
     
     elif data == 'domain_filter':
@@ -317,7 +644,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ])
         
         # Add each domain as a button
-        for domain_id, domain_name in DOMAINS.items():
+        for domain_id, domain_name in catalog.domain_names().items():
             keyboard.append([
                 InlineKeyboardButton(domain_name, callback_data=f"domain_{domain_id}")
             ])
@@ -336,103 +663,86 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         domain_part = data.split('_')[1]
         
         if domain_part == 'all':
-            update_user_filters(user_id, domain=None, placement=None)
+            filters = await backend.update_user_filters(user_id, domain=None, placement=None)
             await query.edit_message_text(
                 text="✅ Filter updated: All domains selected"
             )
         else:
             domain_id = int(domain_part)
-            update_user_filters(user_id, domain=domain_id, placement=None)
+            filters = await backend.update_user_filters(user_id, domain=domain_id, placement=None)
             await query.edit_message_text(
-                text=f"✅ Filter updated: Domain {DOMAINS.get(domain_id, domain_id)} selected"
+                text=f"✅ Filter updated: Domain {catalog.domain_name(domain_id, domain_id)} selected"
             )
         
-        await show_main_menu(update, context)
+        await show_main_menu(update, context, filters)
         return MAIN_MENU
     
     elif data == 'placement_filter':
-        filters = get_user_filters(user_id) or {}
-        domain_id = filters.get('domain')
-        
-        if not domain_id:
-            await query.answer("Please select a domain first")
-            return
-        
-        placements = await get_placements(domain_id)
-        
-        if not placements:
-            await query.answer("No placements found for this domain")
-            return
-        
-        keyboard = []
-        
-        # Add all placements option
-        keyboard.append([
-            InlineKeyboardButton("All Placements", callback_data="placement_all")
-        ])
-        
-        # Add each placement as a button
-        for placement in placements[:10]:  # Limit to 10 placements
-            placement_id = placement.get('id')
-            placement_name = placement.get('alias') or placement.get('title') or f"Placement {placement_id}"
-            keyboard.append([
-                InlineKeyboardButton(placement_name, callback_data=f"placement_{placement_id}")
-            ])
-        
-        # Add back button
-        keyboard.append([
-            InlineKeyboardButton("🔙 Back", callback_data="back_to_menu")
-        ])
-        
-        await query.edit_message_text(
-            text="🎯 Select placement:",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+        await show_placement_menu(update, context, 0)
+
+    elif data.startswith('placements_'):
+        await show_placement_menu(update, context, int(data.split('_')[1]))
     
     elif data.startswith('placement_'):
         placement_part = data.split('_')[1]
         
         if placement_part == 'all':
-            update_user_filters(user_id, placement=None)
+            filters = await backend.update_user_filters(user_id, placement=None)
             await query.edit_message_text(
                 text="✅ Filter updated: All placements selected"
             )
         else:
             placement_id = int(placement_part)
-            update_user_filters(user_id, placement=placement_id)
+            filters = await backend.update_user_filters(user_id, placement=placement_id)
             await query.edit_message_text(
                 text=f"✅ Filter updated: Placement {placement_id} selected"
             )
         
-        await show_main_menu(update, context)
+        await show_main_menu(update, context, filters)
         return MAIN_MENU
     
     elif data == 'toggle_group':
-        filters = get_user_filters(user_id) or {}
+        filters = await backend.get_user_filters(user_id) or {}
         current_group = filters.get('group_by', 'date')
-        new_group = 'country' if current_group == 'date' else 'date'
+        if current_group in GROUP_BY_CYCLE:
+            new_group = GROUP_BY_CYCLE[(GROUP_BY_CYCLE.index(current_group) + 1) % len(GROUP_BY_CYCLE)]
+        else:
+            new_group = 'date'
         
-        update_user_filters(user_id, group_by=new_group)
+        filters = await backend.update_user_filters(user_id, group_by=new_group)
         await query.edit_message_text(
             text=f"✅ Group by changed to {new_group.capitalize()}"
         )
-        await generate_report(update, context)
+        await generate_report(update, context, filters=filters)
         return MAIN_MENU
     
+    elif data == 'toggle_view':
+        context.user_data['view'] = 'text' if context.user_data.get('view') == 'chart' else 'chart'
+        await query.edit_message_text(
+            text=f"✅ Report view changed to {context.user_data['view'].capitalize()}"
+        )
+        await show_main_menu(update, context)
+        return MAIN_MENU
+
     elif data == 'reset_filters':
-        update_user_filters(user_id, start_date=None, end_date=None, domain=None, placement=None, group_by='date')
+        filters = await backend.update_user_filters(user_id, start_date=None, end_date=None, domain=None, placement=None, group_by='date')
         await query.edit_message_text(
             text="✅ All filters have been reset"
         )
-        await show_main_menu(update, context)
+        await show_main_menu(update, context, filters)
         return MAIN_MENU
     
     elif data == 'back_to_menu':
         await show_main_menu(update, context)
         return MAIN_MENU
 
+@timed_handler()
 async def date_filter_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
+    if not await backend.get_user_session(user_id):
+        await update.message.reply_text("🔒 Please /start and login first.")
+        return ConversationHandler.END
+
     text = update.message.text.strip()
     
     try:
@@ -444,7 +754,7 @@ async def date_filter_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
             if start_date > end_date:
                 raise ValueError("Start date cannot be after end date")
             
-            update_user_filters(
+            filters = await backend.update_user_filters(
                 user_id,
                 start_date=start_date.isoformat(),
                 end_date=end_date.isoformat()
@@ -453,7 +763,7 @@ async def date_filter_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
             await update.message.reply_text(
                 f"✅ Date range set to {start_date} to {end_date}"
             )
-            await generate_report(update, context, start_date.isoformat(), end_date.isoformat())
+            await generate_report(update, context, start_date.isoformat(), end_date.isoformat(), filters)
             return MAIN_MENU
         else:
             raise ValueError("Invalid format")
@@ -468,8 +778,52 @@ async def date_filter_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
         return DATE_FILTER
 
-def main():
-    application = Application.builder().token(BOT_TOKEN).build()
+async def post_init(application: Application):
+    global sender, metrics_server
+    await tenants.load()
+    init_client()
+    stats_cache.shared = backend
+    sender = MessageSender(application.bot, SENDER_RATE, SENDER_PER_CHAT_INTERVAL)
+    sender.start()
+    if METRICS_PORT:
+        metrics_server = await webserver.serve({'/metrics': metrics.handle_metrics}, METRICS_LISTEN, METRICS_PORT)
+    scheduler.run_periodic(LOOP_LAG_INTERVAL, metrics.sample_loop_lag)
+    scheduler.run_periodic(TENANT_REFRESH_INTERVAL, tenants.load, first_delay=TENANT_REFRESH_INTERVAL)
+    scheduler.run_periodic(CATALOG_REFRESH_INTERVAL, catalog.refresh)
+    scheduler.run_periodic(WAREHOUSE_SYNC_INTERVAL, warehouse.sync)
+    scheduler.run_periodic(USER_STATE_FLUSH_INTERVAL, backend.flush)
+    scheduler.run_periodic(PREWARM_TICK, prewarm.warm, first_delay=5)
+    scheduler.run_periodic(ALERT_INTERVAL, alerts.run_alerts, sender, first_delay=ALERT_INTERVAL)
+    scheduler.run_periodic(
+        digest.seconds_until_next_hour,
+        digest.run_digests,
+        sender,
+        first_delay=digest.seconds_until_next_hour()
+    )
+
+async def post_shutdown(application: Application):
+    if metrics_server is not None:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+    await scheduler.stop()
+    await charts.shutdown()
+    await sender.stop()
+    await close_client()
+    await backend.close()
+    warehouse.close_warehouse()
+
+def build_application(builder=None):
+    # builder lets benchmarks swap in a fake Telegram transport
+    application = (
+        (builder or Application.builder())
+        .application_class(OrderedApplication)
+        .token(BOT_TOKEN)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .persistence(BackendPersistence(backend, update_interval=USER_STATE_FLUSH_INTERVAL))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # ✅ Pindahkan /start ke dalam ConversationHandler
     conv_handler = ConversationHandler(
@@ -482,13 +836,31 @@ def main():
             MAIN_MENU: [CallbackQueryHandler(button_handler)],
             DATE_FILTER: [MessageHandler(filters.TEXT & ~filters.COMMAND, date_filter_handler)],
         },
-        fallbacks=[CommandHandler('cancel', cancel)]
+        fallbacks=[CommandHandler('cancel', cancel)],
+        # /start must work from any state, e.g. after a logout or an expired login
+        allow_reentry=True,
+        name='main',
+        persistent=True
     )
 
+    application.add_handler(TypeHandler(Update, activate_tenant), group=-1)
     application.add_handler(conv_handler)
     application.add_handler(CommandHandler('logout', logout))
+    application.add_handler(CommandHandler('subscribe', subscribe))
+    application.add_handler(CommandHandler('unsubscribe', unsubscribe))
+    application.add_handler(CommandHandler('export', export_command))
+    application.add_handler(CommandHandler('alert', alert_command))
+    application.add_handler(CommandHandler('alerts', alerts_command))
+    application.add_handler(CommandHandler('stats', stats_command))
+    return application
+
+def main():
+    application = build_application()
 
-    application.run_polling()
+    if BOT_MODE == 'webhook':
+        webhook.run(application)
+    else:
+        application.run_polling()
 
 if __name__ == '__main__':
     main()
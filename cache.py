@@ -0,0 +1,122 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    # In-process LRU cache with per-key TTLs. Concurrent loads of the same key
+    # share one in-flight task (single-flight), so N callers cost one upstream call.
+    # An optional `shared` state backend acts as a second level other workers see.
+
+    def __init__(self, maxsize=512, default_ttl=60, namespace=None, shared=None):
+        self.maxsize = maxsize
+        self.default_ttl = default_ttl
+        self.namespace = namespace
+        self.shared = shared
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.shared_hits = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+
+        self._data.move_to_end(key)
+        return value
+
+    def lookup(self, key):
+        # get() that counts towards the hit ratio, for callers without a loader
+        value = self.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def expires_in(self, key):
+        entry = self._data.get(key)
+        return max(0.0, entry[0] - time.monotonic()) if entry else 0.0
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    async def get_or_load(self, key, loader, ttl=None, force=False):
+        # force=True reloads even if cached; the old value is served until it lands
+        value = None if force else self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(key, loader, ttl, force))
+            self._inflight[key] = task
+        else:
+            self.coalesced += 1
+
+        # shield: one caller being cancelled must not cancel the load for the others
+        return await asyncio.shield(task)
+
+    async def _load(self, key, loader, ttl, force=False):
+        try:
+            shared = self.shared if self.shared is not None and self.shared.shares_cache else None
+            value = None
+            if shared is not None and not force:
+                value = await shared.cache_get(self.namespace, key)
+                if value is not None:
+                    self.shared_hits += 1
+            loaded = value is None
+
+            if loaded:
+                value = await loader()
+            # Failed loads (None) are never cached
+            if value is None:
+                return None
+
+            ttl = ttl(value) if callable(ttl) else ttl
+            if shared is not None and loaded:
+                await shared.cache_set(self.namespace, key, value, ttl or self.default_ttl)
+            self.set(key, value, ttl)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "shared_hits": self.shared_hits,
+            "inflight": len(self._inflight),
+            "hit_ratio": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
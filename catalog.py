@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import time
+
+import tenants
+from config import (
+    CATALOG_TTL,
+    FANOUT_CONCURRENCY
+)
+from adsterra_api import fetch_domains, fetch_placements
+
+logger = logging.getLogger(__name__)
+
+class StaleWhileRevalidate:
+    # Keeps the last good value of every key. Fresh values are returned as is,
+    # stale ones are returned too while a background task refreshes them, and
+    # a failed refresh keeps serving the old value. Only a key that was never
+    # loaded makes the caller wait.
+
+    def __init__(self, loader, ttl):
+        self.loader = loader
+        self.ttl = ttl
+        self._entries = {}  # key -> (value, loaded_at)
+        self._refreshing = {}
+
+    def peek(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[1] > self.ttl:
+            self.revalidate(key)
+        return entry[0]
+
+    def is_stale(self, key):
+        entry = self._entries.get(key)
+        return entry is None or time.monotonic() - entry[1] > self.ttl
+
+    async def get(self, key):
+        value = self.peek(key)
+        if value is not None:
+            return value
+        return await self.revalidate(key)
+
+    def revalidate(self, key):
+        task = self._refreshing.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key))
+            self._refreshing[key] = task
+        return asyncio.shield(task)
+
+    async def _load(self, key):
+        try:
+            value = await self.loader(key)
+            if value is None:
+                entry = self._entries.get(key)
+                return entry[0] if entry else None
+            self._entries[key] = (value, time.monotonic())
+            return value
+        finally:
+            self._refreshing.pop(key, None)
+
+# Keys start with the tenant id; loads run as that tenant whatever task
+# happens to trigger them
+async def _load_domains(tenant_id):
+    tenant = tenants.get(tenant_id)
+    if tenant is None:
+        return None
+    with tenants.using(tenant):
+        items = await fetch_domains()
+    if not items:
+        return None
+    return {item['id']: f"{item.get('title') or item['id']} ({item['id']})" for item in items}
+
+async def _load_placements(key):
+    tenant_id, domain_id = key
+    tenant = tenants.get(tenant_id)
+    if tenant is None:
+        return None
+    with tenants.using(tenant):
+        return await fetch_placements(domain_id)
+
+_domains = StaleWhileRevalidate(_load_domains, CATALOG_TTL)
+_placements = StaleWhileRevalidate(_load_placements, CATALOG_TTL)
+
+def domain_names():
+    # Never waits: the last known domains, or the tenant's configured domains
+    # before the first load
+    tenant = tenants.active()
+    return _domains.peek(tenant.id) or tenant.domains
+
+def domain_name(domain_id, default=None):
+    return domain_names().get(domain_id, default)
+
+def cached_placements(domain_id):
+    # None while the domain's placements have never been loaded
+    return _placements.peek((tenants.active().id, domain_id))
+
+def placement_name(domain_id, placement_id):
+    for item in cached_placements(domain_id) or ():
+        if item.get('id') == placement_id:
+            return item.get('alias') or item.get('title')
+    return None
+
+def load_placements(domain_id):
+    _placements.revalidate((tenants.active().id, domain_id))
+
+async def placements(domain_id):
+    return await _placements.get((tenants.active().id, domain_id)) or []
+
+async def placements_for(domain_ids, concurrency=FANOUT_CONCURRENCY):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def load(domain_id):
+        async with semaphore:
+            return await placements(domain_id)
+
+    results = await asyncio.gather(*(load(domain_id) for domain_id in domain_ids))
+    return dict(zip(domain_ids, results))
+
+async def refresh():
+    # Background job: reloads whatever is stale, so menus never wait on the API
+    for tenant in tenants.all_tenants():
+        with tenants.using(tenant):
+            await refresh_tenant()
+
+async def refresh_tenant():
+    tenant_id = tenants.active().id
+    if _domains.is_stale(tenant_id):
+        await _domains.revalidate(tenant_id)
+
+    semaphore = asyncio.Semaphore(FANOUT_CONCURRENCY)
+
+    async def load(domain_id):
+        async with semaphore:
+            await _placements.revalidate((tenant_id, domain_id))
+
+    stale = [domain_id for domain_id in domain_names() if _placements.is_stale((tenant_id, domain_id))]
+    await asyncio.gather(*(load(domain_id) for domain_id in stale))
+    if stale:
+        logger.info("Catalog refreshed placements for %d domain(s)", len(stale))
@@ -0,0 +1,69 @@
+import io
+import json
+import struct
+import sys
+
+# Chart worker process. It runs this file as its own main module, so unlike a
+# multiprocessing worker it never imports bot.py (database, state backend) and
+# only loads matplotlib. Requests are JSON [data, title], replies are a status
+# byte and the PNG or error text, each framed by a 4 byte length.
+
+TIME_GROUPS = ('date', 'week', 'month')
+
+def render_png(data, title):
+    # The object API is used instead of pyplot, which keeps global state
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    labels = data['labels']
+    figure = Figure(figsize=(8, 4.5), dpi=110)
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
+
+    if data['group_by'] in TIME_GROUPS:
+        positions = range(len(labels))
+        ax.bar(positions, data['impression'], color="#c6dbef", label="Impressions")
+        ax.set_ylabel("Impressions")
+        revenue_ax = ax.twinx()
+        revenue_ax.plot(positions, data['revenue'], color="#08519c", marker="o" if len(labels) <= 40 else None,
+                        label="Earnings")
+        revenue_ax.set_ylabel("Earnings ($)")
+        step = max(1, len(labels) // 12)
+        ax.set_xticks(list(positions)[::step])
+        ax.set_xticklabels(labels[::step], rotation=45, ha="right", fontsize=8)
+    else:
+        positions = range(len(labels))[::-1]
+        ax.barh(list(positions), data['revenue'], color="#08519c")
+        ax.set_yticks(list(positions))
+        ax.set_yticklabels(labels, fontsize=8)
+        ax.set_xlabel("Earnings ($)")
+        for position, revenue in zip(positions, data['revenue']):
+            ax.annotate(f"${revenue:,.2f}", (revenue, position), xytext=(3, 0),
+                        textcoords="offset points", va="center", fontsize=7)
+
+    ax.set_title(title, fontsize=11)
+    ax.grid(axis="y" if data['group_by'] in TIME_GROUPS else "x", alpha=0.3)
+    figure.tight_layout()
+
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+def serve(stdin, stdout):
+    while True:
+        header = stdin.read(4)
+        if len(header) < 4:
+            return
+        data, title = json.loads(stdin.read(struct.unpack(">I", header)[0]))
+        try:
+            status, body = 0, render_png(data, title)
+        except Exception as e:
+            status, body = 1, repr(e).encode()
+        stdout.write(struct.pack(">BI", status, len(body)) + body)
+        stdout.flush()
+
+if __name__ == '__main__':
+    # stdout carries the replies; anything printed goes to stderr instead
+    out = sys.stdout.buffer
+    sys.stdout = sys.stderr
+    serve(sys.stdin.buffer, out)
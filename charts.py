@@ -0,0 +1,144 @@
+import asyncio
+import hashlib
+import importlib.util
+import json
+import logging
+import struct
+import sys
+
+from telegram.error import BadRequest
+
+import chartrender
+from cache import TTLCache
+from metrics import register_cache
+from config import (
+    CHART_WORKERS,
+    CHART_TOP_N,
+    CHART_CACHE_SIZE,
+    CHART_FILE_ID_TTL
+)
+
+logger = logging.getLogger(__name__)
+
+# Charts are only offered when matplotlib is installed
+available = importlib.util.find_spec("matplotlib") is not None
+
+TIME_GROUPS = chartrender.TIME_GROUPS
+
+# Telegram file_id of every chart already uploaded, by (report key, data version)
+file_ids = TTLCache(maxsize=CHART_CACHE_SIZE, default_ttl=CHART_FILE_ID_TTL)
+register_cache("chart_file_ids", file_ids)
+
+# Rendered PNGs, only kept long enough for concurrent identical views to share one render
+_pngs = TTLCache(maxsize=64, default_ttl=60)
+
+# Plotting is CPU bound and holds the GIL, so it runs in worker processes,
+# started on demand and kept for the next render
+_slots = asyncio.Semaphore(CHART_WORKERS)
+_idle = []
+_workers = set()
+
+async def _start_worker():
+    worker = await asyncio.create_subprocess_exec(
+        sys.executable, chartrender.__file__,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE
+    )
+    _workers.add(worker)
+    return worker
+
+def _kill(worker):
+    _workers.discard(worker)
+    if worker.returncode is None:
+        worker.kill()
+
+async def shutdown():
+    _idle.clear()
+    for worker in list(_workers):
+        _workers.discard(worker)
+        worker.stdin.close()
+        try:
+            await asyncio.wait_for(worker.wait(), 5)
+        except asyncio.TimeoutError:
+            worker.kill()
+            await worker.wait()
+
+def chart_data(stats, group_by, top_n=CHART_TOP_N):
+    # Plain lists, cheap to pickle to a worker and to hash
+    items = list(stats.get('items') or [])
+    if group_by in TIME_GROUPS:
+        items.sort(key=lambda item: str(item.get(group_by) or ''))
+    else:
+        items.sort(key=lambda item: float(item.get('revenue', 0) or 0), reverse=True)
+        if len(items) > top_n:
+            rest = items[top_n - 1:]
+            items = items[:top_n - 1] + [{
+                group_by: f"Other ({len(rest)})",
+                'revenue': sum(float(item.get('revenue', 0) or 0) for item in rest),
+                'impression': sum(int(item.get('impression', 0) or 0) for item in rest),
+            }]
+
+    labels = []
+    for item in items:
+        if group_by == 'placement' and item.get('placement_name'):
+            labels.append(str(item['placement_name'])[:24])
+        else:
+            labels.append(str(item.get(group_by) or 'N/A'))
+
+    return {
+        'group_by': group_by,
+        'labels': labels,
+        'revenue': [round(float(item.get('revenue', 0) or 0), 6) for item in items],
+        'impression': [int(item.get('impression', 0) or 0) for item in items],
+    }
+
+def data_version(data):
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+async def _request(worker, data, title):
+    payload = json.dumps([data, title]).encode()
+    worker.stdin.write(struct.pack(">I", len(payload)) + payload)
+    await worker.stdin.drain()
+    status, size = struct.unpack(">BI", await worker.stdout.readexactly(5))
+    return status, await worker.stdout.readexactly(size)
+
+async def render(data, title):
+    async with _slots:
+        worker = None
+        while _idle and worker is None:
+            worker = _idle.pop()
+            if worker.returncode is not None:
+                _kill(worker)
+                worker = None
+        if worker is None:
+            worker = await _start_worker()
+        try:
+            status, body = await _request(worker, data, title)
+        except BaseException:
+            # Dead worker or cancelled mid-reply: the pipe is out of step, drop it
+            _kill(worker)
+            raise
+        _idle.append(worker)
+    if status:
+        raise RuntimeError(f"Chart render failed: {body.decode(errors='replace')}")
+    return body
+
+async def send_chart(bot, chat_id, key, stats, group_by, title, caption, **kwargs):
+    # One photo per report. A chart that was uploaded before is re-sent by its
+    # file_id, so repeat views cost neither a render nor an upload.
+    data = chart_data(stats, group_by)
+    cache_key = (key, data_version(data))
+
+    file_id = file_ids.lookup(cache_key)
+    if file_id is not None:
+        try:
+            return await bot.send_photo(chat_id=chat_id, photo=file_id, caption=caption, **kwargs)
+        except BadRequest as e:
+            logger.warning("Cached chart file_id rejected, uploading again: %s", e)
+            file_ids.invalidate(cache_key)
+
+    png = await _pngs.get_or_load(cache_key, lambda: render(data, title))
+    message = await bot.send_photo(chat_id=chat_id, photo=png, caption=caption, **kwargs)
+    if message.photo:
+        file_ids.set(cache_key, message.photo[-1].file_id)
+    return message
@@ -6,12 +6,136 @@ load_dotenv()
 ADSTERRA_API_KEY = os.getenv("ADSTERRA_API_KEY")
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
-# User credentials (in production, use proper database)
+# "polling" (default) or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # public base URL, setWebhook is skipped when empty
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # required unless WEBHOOK_LISTEN is loopback
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Updates processed in parallel (0 = one at a time); a single user's updates stay ordered
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "32"))
+
+# Prometheus /metrics endpoint, disabled while METRICS_PORT is 0
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "1"))
+
+# Telegram user ids allowed to use /stats, comma separated
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(",") if user_id.strip()}
+
+# Shared HTTP client for the Adsterra API
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+
+# Adsterra quota, retries and circuit breaker
+ADSTERRA_RATE_LIMIT = float(os.getenv("ADSTERRA_RATE_LIMIT", "5"))  # requests per second
+ADSTERRA_RATE_BURST = int(os.getenv("ADSTERRA_RATE_BURST", "10"))
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "30"))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+
+# Max concurrent upstream requests for one breakdown report
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", "8"))
+
+# get_stats response cache (TTL in seconds)
+STATS_CACHE_SIZE = int(os.getenv("STATS_CACHE_SIZE", "512"))
+STATS_CACHE_TTL_LIVE = int(os.getenv("STATS_CACHE_TTL_LIVE", "120"))
+STATS_CACHE_TTL_CLOSED = int(os.getenv("STATS_CACHE_TTL_CLOSED", "21600"))
+
+# Days that Adsterra can still revise (today and yesterday): live TTL, re-synced
+MUTABLE_DAYS = 2
+
+# Ranges at least this many days long are parsed incrementally
+STREAM_MIN_DAYS = int(os.getenv("STREAM_MIN_DAYS", "31"))
+
+# Finished days cached one by one, so overlapping ranges only fetch the new days
+DAY_CACHE_SIZE = int(os.getenv("DAY_CACHE_SIZE", "50000"))
+
+# SQLite connection pool
+DB_PATH = os.getenv("DB_PATH", "sessions.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+
+# Where sessions, filters, conversations and the shared report cache live:
+# "sqlite" (single worker) or "redis" (several workers, each user pinned to one;
+# see state.py)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# In-memory user state (seconds)
+USER_CACHE_IDLE_TTL = int(os.getenv("USER_CACHE_IDLE_TTL", "1800"))
+USER_STATE_FLUSH_INTERVAL = int(os.getenv("USER_STATE_FLUSH_INTERVAL", "5"))
+
+# Local stats warehouse
+WAREHOUSE_DB = os.getenv("WAREHOUSE_DB", "stats.db")
+WAREHOUSE_HISTORY_DAYS = int(os.getenv("WAREHOUSE_HISTORY_DAYS", "400"))
+WAREHOUSE_MAX_SPAN = int(os.getenv("WAREHOUSE_MAX_SPAN", "31"))
+WAREHOUSE_SYNC_INTERVAL = int(os.getenv("WAREHOUSE_SYNC_INTERVAL", "900"))
+
+# Background prefetch of the date presets (seconds)
+PREWARM_TICK = int(os.getenv("PREWARM_TICK", "60"))
+PREWARM_MIN_INTERVAL = int(os.getenv("PREWARM_MIN_INTERVAL", "60"))
+PREWARM_MAX_INTERVAL = int(os.getenv("PREWARM_MAX_INTERVAL", "600"))
+PREWARM_MAX_PER_TICK = int(os.getenv("PREWARM_MAX_PER_TICK", "10"))
+PREWARM_DEMAND_HALF_LIFE = int(os.getenv("PREWARM_DEMAND_HALF_LIFE", "3600"))
+
+# Paginated report messages
+REPORT_PAGE_SIZE = int(os.getenv("REPORT_PAGE_SIZE", "25"))  # entries per page
+REPORT_PAGES_CACHE_SIZE = int(os.getenv("REPORT_PAGES_CACHE_SIZE", "1000"))
+REPORT_PAGES_TTL = int(os.getenv("REPORT_PAGES_TTL", "3600"))
+
+# Chart reports: worker processes for plotting, top-N rows in bar charts and
+# how long uploaded chart file_ids are reused
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", "2"))
+CHART_TOP_N = int(os.getenv("CHART_TOP_N", "15"))
+CHART_CACHE_SIZE = int(os.getenv("CHART_CACHE_SIZE", "1000"))
+CHART_FILE_ID_TTL = int(os.getenv("CHART_FILE_ID_TTL", "86400"))
+
+# /export: days per upstream request, rows held in memory at once, output kept
+# in memory up to EXPORT_SPOOL_SIZE bytes before spilling to disk, and the
+# Bot API upload limit
+EXPORT_CHUNK_DAYS = int(os.getenv("EXPORT_CHUNK_DAYS", "31"))
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "5000"))
+EXPORT_SPOOL_SIZE = int(os.getenv("EXPORT_SPOOL_SIZE", str(8 * 1024 * 1024)))
+EXPORT_MAX_BYTES = int(os.getenv("EXPORT_MAX_BYTES", str(50 * 1024 * 1024)))
+EXPORT_CONCURRENCY = int(os.getenv("EXPORT_CONCURRENCY", "2"))
+EXPORT_PROGRESS_INTERVAL = float(os.getenv("EXPORT_PROGRESS_INTERVAL", "2"))
+
+# Scheduled digests and the bulk message sender
+DIGEST_DAILY_HOUR = int(os.getenv("DIGEST_DAILY_HOUR", "8"))
+SENDER_RATE = float(os.getenv("SENDER_RATE", "25"))  # messages per second, all chats
+SENDER_PER_CHAT_INTERVAL = float(os.getenv("SENDER_PER_CHAT_INTERVAL", "1"))
+
+# Alert rules: checked every ALERT_INTERVAL seconds, baselines of up to
+# ALERT_MAX_WINDOW days
+ALERT_INTERVAL = int(os.getenv("ALERT_INTERVAL", "300"))
+ALERT_MAX_WINDOW = int(os.getenv("ALERT_MAX_WINDOW", "30"))
+ALERT_MAX_PER_USER = int(os.getenv("ALERT_MAX_PER_USER", "20"))
+
+# Tenants (Adsterra accounts) and their logins live in the state backend,
+# managed with scripts/manage_tenants.py. On first start ADSTERRA_API_KEY, USER_DB and
+# DOMAINS are stored as the default tenant; the passwords only as hashes.
+TENANT_REFRESH_INTERVAL = int(os.getenv("TENANT_REFRESH_INTERVAL", "300"))
+
 USER_DB = {
     "tonxmedia": "Sukses2026"
 }
 
-# Domain list (can be fetched from API, but hardcoded for reliability)
+# Domain and placement catalog: entries older than CATALOG_TTL are still
+# served but refreshed in the background, checked every CATALOG_REFRESH_INTERVAL
+CATALOG_TTL = int(os.getenv("CATALOG_TTL", "3600"))
+CATALOG_REFRESH_INTERVAL = int(os.getenv("CATALOG_REFRESH_INTERVAL", "300"))
+PLACEMENT_PAGE_SIZE = int(os.getenv("PLACEMENT_PAGE_SIZE", "8"))
+
+# Domains are discovered from the API (see catalog.py), this list is only
+# used for the default tenant until the first successful /domains.json call
 DOMAINS = {
     1597430: "DIRECTLINK (1597430)",
     4638075: "asupankitasemua.xyz (4638075)"
@@ -1,17 +1,121 @@
+import asyncio
+import json
+import os
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
-def init_db():
-    conn = sqlite3.connect('sessions.db')
+from config import DB_PATH, DB_POOL_SIZE, USER_CACHE_IDLE_TTL
+from metrics import DB_SECONDS
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA mmap_size=67108864"
+)
+
+class ConnectionPool:
+    # Long-lived connections, one per worker thread. Queries run on the pool's
+    # executor so they never block the event loop, and each connection keeps its
+    # own prepared statement cache, so every SQL string is compiled only once.
+
+    def __init__(self, path, size=DB_POOL_SIZE):
+        self.path = path
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="sqlite")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=256)
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _call(self, func, args):
+        return func(self._connection(), *args)
+
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, self._call, func, args)
+        finally:
+            DB_SECONDS.labels(self.name, func.__name__.lstrip('_')).observe(time.perf_counter() - start)
+
+    def run_sync(self, func, *args):
+        # Blocking variant for startup code that runs before the event loop
+        return self._executor.submit(self._call, func, args).result()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+pool = ConnectionPool(DB_PATH)
+
+FILTER_FIELDS = ('start_date', 'end_date', 'domain', 'placement', 'group_by')
+
+DEFAULT_FILTERS = {
+    'start_date': None,
+    'end_date': None,
+    'domain': None,
+    'placement': None,
+    'group_by': 'date'
+}
+
+# Per-user state served from RAM. Filter writes only mark the user dirty and
+# are written back in one batch by flush_user_state().
+_sessions = {}
+_filters = {}
+_last_seen = {}
+_dirty_filters = set()
+
+def _init_db(conn):
     c = conn.cursor()
-    
+
     # Create sessions table
     c.execute('''CREATE TABLE IF NOT EXISTS sessions
-                 (user_id INTEGER PRIMARY KEY, 
-                  username TEXT, 
+                 (user_id INTEGER PRIMARY KEY,
+                  username TEXT,
                   login_time TIMESTAMP,
-                  last_activity TIMESTAMP)''')
-    
+                  last_activity TIMESTAMP,
+                  tenant_id INTEGER)''')
+
+    # Sessions created before tenants existed belong to the default tenant
+    columns = [row[1] for row in c.execute("PRAGMA table_info(sessions)")]
+    if 'tenant_id' not in columns:
+        c.execute("ALTER TABLE sessions ADD COLUMN tenant_id INTEGER")
+        c.execute("UPDATE sessions SET tenant_id=1")
+
+    # Create tenants table (one Adsterra account each, domains as JSON)
+    c.execute('''CREATE TABLE IF NOT EXISTS tenants
+                 (id INTEGER PRIMARY KEY,
+                  name TEXT,
+                  api_key TEXT,
+                  rate_limit REAL,
+                  rate_burst INTEGER,
+                  domains TEXT)''')
+
+    # Create accounts table (bot logins, scrypt password hashes)
+    c.execute('''CREATE TABLE IF NOT EXISTS accounts
+                 (username TEXT PRIMARY KEY,
+                  password_hash TEXT,
+                  tenant_id INTEGER)''')
+
     # Create user filters table
     c.execute('''CREATE TABLE IF NOT EXISTS user_filters
                  (user_id INTEGER PRIMARY KEY,
@@ -20,95 +124,314 @@ def init_db():
                   domain INTEGER,
                   placement INTEGER,
                   group_by TEXT DEFAULT 'date')''')
-    
+
+    # Create digest subscriptions table (daily/hourly)
+    c.execute('''CREATE TABLE IF NOT EXISTS digest_subscriptions
+                 (user_id INTEGER,
+                  chat_id INTEGER,
+                  frequency TEXT,
+                  PRIMARY KEY (user_id, frequency))''')
+
+    # Create conversation state table (ConversationHandler name + JSON key)
+    c.execute('''CREATE TABLE IF NOT EXISTS conversations
+                 (name TEXT,
+                  key TEXT,
+                  state TEXT,
+                  PRIMARY KEY (name, key))''')
+
+    # Create alert rules table (state is ok or firing, as of state_day)
+    c.execute('''CREATE TABLE IF NOT EXISTS alert_rules
+                 (id INTEGER PRIMARY KEY,
+                  user_id INTEGER,
+                  chat_id INTEGER,
+                  tenant_id INTEGER,
+                  domain INTEGER,
+                  placement INTEGER,
+                  metric TEXT,
+                  kind TEXT,
+                  threshold REAL,
+                  param INTEGER,
+                  state TEXT DEFAULT 'ok',
+                  state_day TEXT)''')
+
+    # Create user_data/chat_data/bot_data table (kind is user, chat or bot)
+    c.execute('''CREATE TABLE IF NOT EXISTS persistent_data
+                 (kind TEXT,
+                  id INTEGER,
+                  data TEXT,
+                  PRIMARY KEY (kind, id))''')
+
     conn.commit()
-    conn.close()
 
-def get_user_session(user_id):
-    conn = sqlite3.connect('sessions.db')
-    c = conn.cursor()
-    c.execute("SELECT * FROM sessions WHERE user_id=?", (user_id,))
-    result = c.fetchone()
-    conn.close()
-    return result
+def init_db():
+    pool.run_sync(_init_db)
 
-def create_session(user_id, username):
-    conn = sqlite3.connect('sessions.db')
-    c = conn.cursor()
+def close_db():
+    pool.close()
+
+def _get_user_session(conn, user_id):
+    c = conn.execute('''SELECT user_id, username, login_time, last_activity, tenant_id
+                        FROM sessions WHERE user_id=?''', (user_id,))
+    return c.fetchone()
+
+def _create_session(conn, user_id, username, tenant_id):
     now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    c.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)", 
-              (user_id, username, now, now))
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute('''INSERT OR REPLACE INTO sessions
+                        (user_id, username, login_time, last_activity, tenant_id)
+                        VALUES (?, ?, ?, ?, ?)''',
+                     (user_id, username, now, now, tenant_id))
 
-def delete_session(user_id):
-    conn = sqlite3.connect('sessions.db')
-    c = conn.cursor()
-    c.execute("DELETE FROM sessions WHERE user_id=?", (user_id,))
-    conn.commit()
-    conn.close()
+def _delete_session(conn, user_id):
+    with conn:
+        conn.execute("DELETE FROM sessions WHERE user_id=?", (user_id,))
 
-def update_user_filters(user_id, **filters):
-    conn = sqlite3.connect('sessions.db')
-    c = conn.cursor()
-    
-    # Get existing filters
-    c.execute("SELECT * FROM user_filters WHERE user_id=?", (user_id,))
-    existing = c.fetchone()
-    
-    if existing:
-        # Update existing
-        current_filters = {
-            'start_date': existing[1],
-            'end_date': existing[2],
-            'domain': existing[3],
-            'placement': existing[4],
-            'group_by': existing[5]
-        }
-        current_filters.update(filters)
-        
-        c.execute('''UPDATE user_filters SET 
-                    start_date=?, end_date=?, domain=?, placement=?, group_by=?
-                    WHERE user_id=?''',
-                 (current_filters['start_date'], current_filters['end_date'],
-                  current_filters['domain'], current_filters['placement'],
-                  current_filters['group_by'], user_id))
+def _row_to_filters(row):
+    return dict(zip(FILTER_FIELDS, row[1:])) if row else None
+
+def _get_user_filters(conn, user_id):
+    c = conn.execute("SELECT * FROM user_filters WHERE user_id=?", (user_id,))
+    return _row_to_filters(c.fetchone())
+
+def _save_user_filters(conn, rows):
+    with conn:
+        conn.executemany('''INSERT INTO user_filters
+                            (user_id, start_date, end_date, domain, placement, group_by)
+                            VALUES (?, ?, ?, ?, ?, ?)
+                            ON CONFLICT (user_id) DO UPDATE SET
+                            start_date=excluded.start_date,
+                            end_date=excluded.end_date,
+                            domain=excluded.domain,
+                            placement=excluded.placement,
+                            group_by=excluded.group_by''', rows)
+
+async def get_user_session(user_id):
+    _last_seen[user_id] = time.monotonic()
+    if user_id not in _sessions:
+        row = await pool.run(_get_user_session, user_id)
+        # Same for a login or logout that happened meanwhile
+        return _sessions.setdefault(user_id, row)
+    return _sessions[user_id]
+
+async def create_session(user_id, username, tenant_id=None):
+    # Logins are rare and must survive a crash, so sessions are written through
+    await pool.run(_create_session, user_id, username, tenant_id)
+    _sessions[user_id] = await pool.run(_get_user_session, user_id)
+    _last_seen[user_id] = time.monotonic()
+
+async def delete_session(user_id):
+    await pool.run(_delete_session, user_id)
+    _sessions[user_id] = None
+
+async def update_user_filters(user_id, **filters):
+    # Returns the merged filters so callers don't have to read them back
+    current_filters = await get_user_filters(user_id) or dict(DEFAULT_FILTERS)
+    current_filters.update(filters)
+
+    _filters[user_id] = current_filters
+    _dirty_filters.add(user_id)
+    return dict(current_filters)
+
+async def get_user_filters(user_id):
+    _last_seen[user_id] = time.monotonic()
+    if user_id not in _filters:
+        row = await pool.run(_get_user_filters, user_id)
+        # An update may have merged newer filters in while the row was loading
+        filters = _filters.setdefault(user_id, row)
     else:
-        # Create new
-        default_filters = {
-            'start_date': None,
-            'end_date': None,
-            'domain': None,
-            'placement': None,
-            'group_by': 'date'
-        }
-        default_filters.update(filters)
-        
-        c.execute('''INSERT INTO user_filters VALUES 
-                    (?, ?, ?, ?, ?, ?)''',
-                 (user_id, default_filters['start_date'], 
-                  default_filters['end_date'], default_filters['domain'],
-                  default_filters['placement'], default_filters['group_by']))
-    
-    conn.commit()
-    conn.close()
+        filters = _filters[user_id]
+    return dict(filters) if filters is not None else None
 
-def get_user_filters(user_id):
-    conn = sqlite3.connect('sessions.db')
-    c = conn.cursor()
-    c.execute("SELECT * FROM user_filters WHERE user_id=?", (user_id,))
-    result = c.fetchone()
-    conn.close()
-    
-    if result:
-        return {
-            'start_date': result[1],
-            'end_date': result[2],
-            'domain': result[3],
-            'placement': result[4],
-            'group_by': result[5]
+def _get_filter_combinations(conn):
+    c = conn.execute("SELECT DISTINCT domain, placement, group_by FROM user_filters")
+    return c.fetchall()
+
+async def get_filter_combinations():
+    # Distinct (domain, placement, group_by) users have stored, unflushed ones included
+    combinations = set(await pool.run(_get_filter_combinations))
+    for filters in list(_filters.values()):
+        if filters:
+            combinations.add((filters['domain'], filters['placement'], filters['group_by']))
+    return combinations
+
+def _subscribe_digest(conn, user_id, chat_id, frequency):
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO digest_subscriptions VALUES (?, ?, ?)",
+                     (user_id, chat_id, frequency))
+
+def _unsubscribe_digest(conn, user_id, frequency):
+    with conn:
+        if frequency:
+            conn.execute("DELETE FROM digest_subscriptions WHERE user_id=? AND frequency=?",
+                         (user_id, frequency))
+        else:
+            conn.execute("DELETE FROM digest_subscriptions WHERE user_id=?", (user_id,))
+
+def _get_digest_subscriptions(conn, frequency):
+    c = conn.execute("SELECT user_id, chat_id FROM digest_subscriptions WHERE frequency=?",
+                     (frequency,))
+    return c.fetchall()
+
+def _load_conversations(conn, name):
+    c = conn.execute("SELECT key, state FROM conversations WHERE name=?", (name,))
+    return {tuple(json.loads(key)): json.loads(state) for key, state in c.fetchall()}
+
+def _save_conversations(conn, name, changes):
+    with conn:
+        conn.executemany("DELETE FROM conversations WHERE name=? AND key=?",
+                         [(name, json.dumps(key)) for key, state in changes.items() if state is None])
+        conn.executemany("INSERT OR REPLACE INTO conversations VALUES (?, ?, ?)",
+                         [(name, json.dumps(key), json.dumps(state))
+                          for key, state in changes.items() if state is not None])
+
+def _load_persistent_data(conn, kind):
+    c = conn.execute("SELECT id, data FROM persistent_data WHERE kind=?", (kind,))
+    return {id: json.loads(data) for id, data in c.fetchall()}
+
+def _save_persistent_data(conn, kind, changes):
+    with conn:
+        conn.executemany("DELETE FROM persistent_data WHERE kind=? AND id=?",
+                         [(kind, id) for id, data in changes.items() if data is None])
+        conn.executemany("INSERT OR REPLACE INTO persistent_data VALUES (?, ?, ?)",
+                         [(kind, id, json.dumps(data)) for id, data in changes.items() if data is not None])
+
+def _get_tenants(conn):
+    c = conn.execute("SELECT id, name, api_key, rate_limit, rate_burst, domains FROM tenants ORDER BY id")
+    return [
+        {
+            'id': id,
+            'name': name,
+            'api_key': api_key,
+            'rate_limit': rate_limit,
+            'rate_burst': rate_burst,
+            'domains': {int(domain_id): title for domain_id, title in json.loads(domains or '{}').items()}
         }
-    return None
+        for id, name, api_key, rate_limit, rate_burst, domains in c.fetchall()
+    ]
+
+def _save_tenant(conn, tenant):
+    with conn:
+        c = conn.execute('''INSERT OR REPLACE INTO tenants
+                            (id, name, api_key, rate_limit, rate_burst, domains)
+                            VALUES (?, ?, ?, ?, ?, ?)''',
+                         (tenant.get('id'), tenant['name'], tenant['api_key'], tenant.get('rate_limit'),
+                          tenant.get('rate_burst'), json.dumps(tenant.get('domains') or {})))
+    return c.lastrowid
+
+def _get_account(conn, username):
+    c = conn.execute("SELECT password_hash, tenant_id FROM accounts WHERE username=?", (username,))
+    return c.fetchone()
+
+def _save_account(conn, username, password_hash, tenant_id):
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO accounts VALUES (?, ?, ?)",
+                     (username, password_hash, tenant_id))
+
+async def get_tenants():
+    return await pool.run(_get_tenants)
+
+async def save_tenant(tenant):
+    # tenant: dict with name, api_key and optional id, rate_limit, rate_burst,
+    # domains; returns the id (a new one when id is None)
+    return await pool.run(_save_tenant, tenant)
+
+async def get_account(username):
+    # -> (password_hash, tenant_id) or None
+    return await pool.run(_get_account, username)
+
+async def save_account(username, password_hash, tenant_id):
+    await pool.run(_save_account, username, password_hash, tenant_id)
+
+ALERT_FIELDS = ('id', 'user_id', 'chat_id', 'tenant_id', 'domain', 'placement',
+                'metric', 'kind', 'threshold', 'param', 'state', 'state_day')
+
+def _get_alert_rules(conn, user_id):
+    query = f"SELECT {', '.join(ALERT_FIELDS)} FROM alert_rules"
+    if user_id is None:
+        c = conn.execute(query + " ORDER BY id")
+    else:
+        c = conn.execute(query + " WHERE user_id=? ORDER BY id", (user_id,))
+    return [dict(zip(ALERT_FIELDS, row)) for row in c.fetchall()]
+
+def _add_alert_rule(conn, rule):
+    fields = [field for field in ALERT_FIELDS if field != 'id' and field in rule]
+    with conn:
+        c = conn.execute(f"INSERT INTO alert_rules ({', '.join(fields)}) VALUES ({', '.join('?' * len(fields))})",
+                         [rule[field] for field in fields])
+    return c.lastrowid
+
+def _delete_alert_rule(conn, user_id, rule_id):
+    with conn:
+        c = conn.execute("DELETE FROM alert_rules WHERE id=? AND user_id=?", (rule_id, user_id))
+    return c.rowcount > 0
+
+def _set_alert_state(conn, rule_id, state, day):
+    with conn:
+        conn.execute("UPDATE alert_rules SET state=?, state_day=? WHERE id=?", (state, day, rule_id))
+
+async def get_alert_rules(user_id=None):
+    # All rules, or one user's; dicts with ALERT_FIELDS
+    return await pool.run(_get_alert_rules, user_id)
+
+async def add_alert_rule(rule):
+    return await pool.run(_add_alert_rule, rule)
+
+async def delete_alert_rule(user_id, rule_id):
+    return await pool.run(_delete_alert_rule, user_id, rule_id)
+
+async def set_alert_state(rule_id, state, day):
+    await pool.run(_set_alert_state, rule_id, state, day)
+
+async def subscribe_digest(user_id, chat_id, frequency):
+    await pool.run(_subscribe_digest, user_id, chat_id, frequency)
+
+async def unsubscribe_digest(user_id, frequency=None):
+    await pool.run(_unsubscribe_digest, user_id, frequency)
+
+async def get_digest_subscriptions(frequency):
+    return await pool.run(_get_digest_subscriptions, frequency)
+
+async def load_conversations(name):
+    return await pool.run(_load_conversations, name)
+
+async def save_conversations(name, changes):
+    # changes: {key: state}, a state of None ends the conversation
+    await pool.run(_save_conversations, name, changes)
+
+async def load_persistent_data(kind):
+    return await pool.run(_load_persistent_data, kind)
+
+async def save_persistent_data(kind, changes):
+    # changes: {id: data}, None drops the entry
+    await pool.run(_save_persistent_data, kind, changes)
+
+async def flush_user_state():
+    # Snapshot and clear without awaiting in between, so writes made while the
+    # batch is being saved are picked up by the next flush
+    rows = [
+        (user_id, *(_filters[user_id][field] for field in FILTER_FIELDS))
+        for user_id in _dirty_filters
+    ]
+    dirty = set(_dirty_filters)
+    _dirty_filters.clear()
+
+    if rows:
+        try:
+            await pool.run(_save_user_filters, rows)
+        except Exception:
+            _dirty_filters.update(dirty)
+            raise
+
+    _evict_idle()
+    return len(rows)
+
+def _evict_idle():
+    cutoff = time.monotonic() - USER_CACHE_IDLE_TTL
+    for user_id, last_seen in list(_last_seen.items()):
+        if last_seen < cutoff and user_id not in _dirty_filters:
+            _sessions.pop(user_id, None)
+            _filters.pop(user_id, None)
+            del _last_seen[user_id]
 
 # Initialize database on import
-init_db()
\ No newline at end of file
+init_db()
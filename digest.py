@@ -0,0 +1,85 @@
+import logging
+from datetime import datetime, timedelta
+
+from telegram.helpers import escape_markdown
+
+import catalog
+import tenants
+from config import DIGEST_DAILY_HOUR
+from state import backend
+from adsterra_api import calculate_summary, format_summary
+from reports import load_stats
+
+logger = logging.getLogger(__name__)
+
+FREQUENCIES = ('daily', 'hourly')
+
+def digest_range(frequency, now=None):
+    today = (now or datetime.now()).date()
+    # Daily digest covers the finished previous day, hourly covers today so far
+    if frequency == 'daily':
+        day = today - timedelta(days=1)
+        return day.isoformat(), day.isoformat()
+    return today.isoformat(), today.isoformat()
+
+def seconds_until_next_hour(now=None):
+    now = now or datetime.now()
+    next_hour = (now + timedelta(hours=1)).replace(minute=0, second=0, microsecond=0)
+    return max(1.0, (next_hour - now).total_seconds())
+
+def digest_title(frequency, domain, placement):
+    # Domain names come from the API, the digest is sent as Markdown
+    name = catalog.domain_name(domain, str(domain)) if domain else 'All Domains'
+    target = escape_markdown(str(name))
+    if placement:
+        target += f" / Placement {placement}"
+    kind = "Daily" if frequency == 'daily' else "Hourly"
+    return f"📬 *{kind} Digest* - {target}"
+
+async def send_digest(sender, frequency):
+    subscriptions = await backend.get_digest_subscriptions(frequency)
+    if not subscriptions:
+        return 0
+
+    # Every distinct tenant and filter combination is computed once, then fanned out
+    audiences = {}
+    for user_id, chat_id in subscriptions:
+        # Only for users logged in to a tenant that still exists
+        tenant = tenants.for_session(await backend.get_user_session(user_id))
+        if tenant is None:
+            continue
+        filters = await backend.get_user_filters(user_id) or {}
+        key = (tenant.id, filters.get('domain'), filters.get('placement'))
+        audiences.setdefault(key, []).append(chat_id)
+
+    start_date, end_date = digest_range(frequency)
+    queued = 0
+    for (tenant_id, domain, placement), chat_ids in audiences.items():
+        tenant = tenants.get(tenant_id)
+        if tenant is None:
+            continue
+        with tenants.using(tenant):
+            stats = await load_stats(start_date, end_date, domain, placement, 'date')
+            title = digest_title(frequency, domain, placement)
+        if not stats:
+            logger.warning("Skipping %s digest for %s/%s: no data", frequency, domain, placement)
+            continue
+
+        summary_text = format_summary(calculate_summary(stats), start_date, end_date)
+        text = f"{title}\n\n{summary_text}"
+        for chat_id in chat_ids:
+            sender.send_message(chat_id, text, parse_mode='Markdown')
+            queued += 1
+
+    logger.info("Queued %d %s digest(s) for %d filter combination(s)", queued, frequency, len(audiences))
+    return queued
+
+async def run_digests(sender):
+    # Runs at the top of every hour, on one worker only
+    now = datetime.now()
+    if not await backend.acquire_lock(f"digest:{now:%Y-%m-%d-%H}", 3600):
+        return
+
+    await send_digest(sender, 'hourly')
+    if now.hour == DIGEST_DAILY_HOUR:
+        await send_digest(sender, 'daily')
@@ -0,0 +1,185 @@
+import asyncio
+import csv
+import gzip
+import importlib.util
+import io
+import logging
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from telegram import InputFile
+from telegram.error import BadRequest
+
+from adsterra_api import stream_stats
+from config import (
+    EXPORT_CHUNK_DAYS,
+    EXPORT_BATCH_ROWS,
+    EXPORT_SPOOL_SIZE,
+    EXPORT_MAX_BYTES,
+    EXPORT_CONCURRENCY,
+    EXPORT_PROGRESS_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+# Parquet is only offered when pyarrow is installed
+parquet_available = importlib.util.find_spec("pyarrow") is not None
+FORMATS = ('csv', 'parquet') if parquet_available else ('csv',)
+
+METRIC_COLUMNS = ['impression', 'clicks', 'ctr', 'cpm', 'revenue']
+
+# Exports running at once across all users, each one is a stream of upstream requests
+_slots = asyncio.Semaphore(EXPORT_CONCURRENCY)
+# One export per user at a time
+running = set()
+
+def export_dims(group_by):
+    # Raw rows are always per day; week/month are just rollups of those days
+    if group_by in (None, 'date', 'week', 'month'):
+        return ['date']
+    return ['date', group_by]
+
+def chunks(start_date, end_date, days=EXPORT_CHUNK_DAYS):
+    # Upstream requests of at most `days` days each, oldest first
+    start = datetime.strptime(str(start_date), '%Y-%m-%d').date()
+    end = datetime.strptime(str(end_date), '%Y-%m-%d').date()
+    while start <= end:
+        chunk_end = min(end, start + timedelta(days=days - 1))
+        yield start.isoformat(), chunk_end.isoformat()
+        start = chunk_end + timedelta(days=1)
+
+async def iter_batches(start_date, end_date, domain, placement, dims, progress=None):
+    # Rows in batches of at most EXPORT_BATCH_ROWS; only one batch is ever held.
+    # progress(done_chunks, total_chunks, rows) is awaited after every chunk.
+    ranges = list(chunks(start_date, end_date))
+    rows = 0
+    for index, (chunk_start, chunk_end) in enumerate(ranges):
+        batch = []
+        async for item in stream_stats(chunk_start, chunk_end, domain, placement, dims):
+            batch.append(item)
+            if len(batch) >= EXPORT_BATCH_ROWS:
+                rows += len(batch)
+                yield batch
+                batch = []
+        if batch:
+            rows += len(batch)
+            yield batch
+        if progress is not None:
+            await progress(index + 1, len(ranges), rows)
+
+async def write_csv(out, batches, columns):
+    # gzip over the spooled file; the csv module writes into it row by row
+    with gzip.GzipFile(fileobj=out, mode='wb') as gz:
+        text = io.TextIOWrapper(gz, encoding='utf-8', newline='')
+        writer = csv.DictWriter(text, fieldnames=columns, extrasaction='ignore')
+        writer.writeheader()
+        async for batch in batches:
+            writer.writerows(batch)
+        text.flush()
+        text.detach()
+
+async def write_parquet(out, batches, columns):
+    # One row group per batch
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema(
+        [(name, pa.string()) for name in columns[:-len(METRIC_COLUMNS)]]
+        + [('impression', pa.int64()), ('clicks', pa.int64()), ('ctr', pa.float64()),
+           ('cpm', pa.float64()), ('revenue', pa.float64())]
+    )
+    writer = pq.ParquetWriter(out, schema, compression='zstd')
+    try:
+        async for batch in batches:
+            data = {
+                name: [None if item.get(name) is None else str(item[name]) for item in batch]
+                for name in columns[:-len(METRIC_COLUMNS)]
+            }
+            for name in METRIC_COLUMNS:
+                data[name] = [item.get(name) for item in batch]
+            writer.write_table(pa.Table.from_pydict(data, schema=schema))
+    finally:
+        writer.close()
+
+async def build_export(start_date, end_date, domain=None, placement=None, group_by='date', fmt='csv', progress=None):
+    # Returns a spooled temporary file positioned at 0: in memory while small,
+    # rolled over to disk past EXPORT_SPOOL_SIZE
+    dims = export_dims(group_by)
+    columns = dims + METRIC_COLUMNS
+    out = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    try:
+        batches = iter_batches(start_date, end_date, domain, placement, dims, progress)
+        if fmt == 'parquet':
+            await write_parquet(out, batches, columns)
+        else:
+            await write_csv(out, batches, columns)
+    except BaseException:
+        out.close()
+        raise
+    out.seek(0)
+    return out
+
+def export_filename(start_date, end_date, group_by, fmt):
+    suffix = 'parquet' if fmt == 'parquet' else 'csv.gz'
+    return f"adsterra_{start_date}_{end_date}_{'_'.join(export_dims(group_by))}.{suffix}"
+
+class Progress:
+    # Edits one status message, at most every EXPORT_PROGRESS_INTERVAL seconds
+
+    def __init__(self, message):
+        self.message = message
+        self.last = 0.0
+
+    async def __call__(self, done, total, rows):
+        now = time.monotonic()
+        if done < total and now - self.last < EXPORT_PROGRESS_INTERVAL:
+            return
+        self.last = now
+        try:
+            await self.message.edit_text(f"⏳ Exporting... {done}/{total} requests, {rows:,} rows")
+        except BadRequest:
+            pass
+
+async def run_export(bot, chat_id, user_id, filters, fmt='csv'):
+    # None in stored filters means no range was chosen
+    start_date = filters.get('start_date') or datetime.now().date().isoformat()
+    end_date = filters.get('end_date') or datetime.now().date().isoformat()
+    domain = filters.get('domain')
+    placement = filters.get('placement')
+    group_by = filters.get('group_by', 'date')
+
+    try:
+        status = await bot.send_message(chat_id=chat_id, text="⏳ Export queued...")
+    except Exception:
+        running.discard(user_id)
+        raise
+
+    try:
+        async with _slots:
+            out = await build_export(
+                start_date, end_date, domain, placement, group_by, fmt, progress=Progress(status)
+            )
+        with out:
+            out.seek(0, io.SEEK_END)
+            size = out.tell()
+            out.seek(0)
+            if size > EXPORT_MAX_BYTES:
+                await status.edit_text(
+                    f"❌ The export is {size / 1024 / 1024:.1f} MB, over Telegram's upload limit. "
+                    "Please pick a shorter date range."
+                )
+                return
+            # The Bot API upload is a single multipart body, so the finished
+            # (compressed) file is read once here
+            await bot.send_document(
+                chat_id=chat_id,
+                document=InputFile(out.read(), filename=export_filename(start_date, end_date, group_by, fmt)),
+                caption=f"📦 {start_date} to {end_date}"
+            )
+        await status.edit_text(f"✅ Export finished ({size / 1024:,.0f} KB)")
+    except Exception as e:
+        logger.exception("Export failed: %s", e)
+        await status.edit_text("❌ Export failed, please try again later")
+    finally:
+        running.discard(user_id)
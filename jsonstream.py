@@ -0,0 +1,97 @@
+import json
+
+_decoder = json.JSONDecoder()
+
+WHITESPACE = ' \t\n\r'
+
+class _Reader:
+    # Text buffer over an async iterator of chunks. Only the unread tail is kept.
+
+    def __init__(self, chunks):
+        self.chunks = chunks.__aiter__()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    async def fill(self):
+        if self.eof:
+            return False
+        try:
+            chunk = await self.chunks.__anext__()
+        except StopAsyncIteration:
+            self.eof = True
+            return False
+
+        if self.pos:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        self.buf += chunk
+        return True
+
+    async def peek(self):
+        # Next non-whitespace character, '' at the end of the stream
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not await self.fill():
+                return ''
+
+    async def expect(self, char):
+        if await self.peek() != char:
+            raise ValueError(f"Expected {char!r} in JSON stream")
+        self.pos += 1
+
+    async def value(self):
+        await self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            else:
+                # A number at the very end of the buffer may still continue
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            await self.fill()
+
+async def iter_items(chunks, key="items", meta=None):
+    # Yields the elements of the top-level `key` array of a JSON object as they
+    # arrive. Other top-level members are decoded whole and stored in `meta`.
+    reader = _Reader(chunks)
+    await reader.expect('{')
+
+    while True:
+        char = await reader.peek()
+        if char == '}':
+            return
+        if char == ',':
+            reader.pos += 1
+            continue
+        if char == '':
+            raise ValueError("Unexpected end of JSON stream")
+
+        name = await reader.value()
+        await reader.expect(':')
+
+        if name != key or await reader.peek() != '[':
+            value = await reader.value()
+            if meta is not None:
+                meta[name] = value
+            continue
+
+        reader.pos += 1
+        while True:
+            char = await reader.peek()
+            if char == ']':
+                reader.pos += 1
+                break
+            if char == ',':
+                reader.pos += 1
+                continue
+            if char == '':
+                raise ValueError("Unexpected end of JSON stream")
+            yield await reader.value()
@@ -0,0 +1,269 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from functools import wraps
+
+# In-process metrics in the Prometheus text format. Recording is a dict lookup
+# plus a bisect, cheap enough for every update, query and API call. Values that
+# already live elsewhere (cache counters, queue sizes) are read at scrape time.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Label combinations per metric, further ones are folded into "other" so
+# arbitrary callback data can't grow the registry without bound
+MAX_SERIES = 200
+
+registry = []
+caches = {}
+started_at = time.time()
+
+class _Metric(ABC):
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._children = {}
+        registry.append(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(self._children) >= MAX_SERIES:
+                values = ("other",) * len(self.labelnames)
+                child = self._children.get(values)
+            if child is None:
+                child = self._children[values] = self._new_child()
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        ...
+
+    def _label_text(self, values, extra=()):
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{self._label_text(values)} {child.value:g}"]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+class _Buckets:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, labels)
+
+    def _new_child(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _render_child(self, values, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else f"{bound:g}"
+            lines.append(f"{self.name}_bucket{self._label_text(values, [('le', le)])} {cumulative}")
+        lines.append(f"{self.name}_sum{self._label_text(values)} {child.sum:g}")
+        lines.append(f"{self.name}_count{self._label_text(values)} {child.count}")
+        return lines
+
+class CallbackGauge(_Metric):
+    # Value computed at scrape time: func() -> number or {label values: number}
+    kind = "gauge"
+
+    def __init__(self, name, help, func, labels=()):
+        super().__init__(name, help, labels)
+        self.func = func
+
+    def _new_child(self):
+        raise TypeError(f"{self.name} is computed by its callback and has no child series")
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        result = self.func()
+        items = result.items() if isinstance(result, dict) else [((), result)]
+        for values, value in items:
+            lines.append(f"{self.name}{self._label_text(values)} {value:g}")
+        return lines
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def register_cache(name, cache):
+    # Any object with a TTLCache-style stats() method
+    caches[name] = cache
+
+def _cache_stat(field):
+    return lambda: {(name,): cache.stats()[field] for name, cache in caches.items()}
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Time spent handling an update, by handler", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Handlers that raised, by handler", ("handler",))
+UPDATES_IN_FLIGHT = Gauge("bot_updates_in_flight", "Updates currently being handled")
+DB_SECONDS = Histogram("db_query_seconds", "SQLite call latency including executor queueing", ("db", "query"))
+API_SECONDS = Histogram("adsterra_request_seconds", "Adsterra API request latency per attempt", ("endpoint",))
+API_REQUESTS = Counter("adsterra_requests_total", "Adsterra API attempts by endpoint and status", ("endpoint", "status"))
+API_IN_FLIGHT = Gauge("adsterra_requests_in_flight", "Adsterra API requests waiting for a response")
+LOOP_LAG = Histogram("event_loop_lag_seconds", "Delay before a ready callback gets to run",
+                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+LOOP_LAG_LAST = Gauge("event_loop_lag_last_seconds", "Most recent event loop lag sample")
+
+CallbackGauge("cache_hits", "Cache hits", _cache_stat("hits"), ("cache",))
+CallbackGauge("cache_misses", "Cache misses", _cache_stat("misses"), ("cache",))
+CallbackGauge("cache_hit_ratio", "Cache hits / lookups", _cache_stat("hit_ratio"), ("cache",))
+CallbackGauge("cache_entries", "Entries currently cached", _cache_stat("size"), ("cache",))
+CallbackGauge("cache_loads_in_flight", "Cache loads currently running", _cache_stat("inflight"), ("cache",))
+CallbackGauge("process_uptime_seconds", "Seconds since the process started", lambda: time.time() - started_at)
+
+def timed_handler(label=None):
+    # Decorator for PTB callbacks; label(update) picks the handler label,
+    # default is the function name
+    def decorate(func):
+        name = func.__name__
+
+        @wraps(func)
+        async def wrapper(update, context):
+            handler = label(update) if label else name
+            UPDATES_IN_FLIGHT.inc()
+            start = time.perf_counter()
+            try:
+                return await func(update, context)
+            except Exception:
+                HANDLER_ERRORS.labels(handler).inc()
+                raise
+            finally:
+                HANDLER_SECONDS.labels(handler).observe(time.perf_counter() - start)
+                UPDATES_IN_FLIGHT.dec()
+
+        return wrapper
+
+    return decorate
+
+async def sample_loop_lag():
+    # One yield to the loop: the time until we run again is how long every
+    # other ready callback took
+    start = time.perf_counter()
+    await asyncio.sleep(0)
+    lag = time.perf_counter() - start
+    LOOP_LAG.observe(lag)
+    LOOP_LAG_LAST.set(lag)
+
+def _top(histogram, limit):
+    children = sorted(histogram._children.items(), key=lambda item: item[1].count, reverse=True)
+    return children[:limit]
+
+def summary(limit=8):
+    # Plain-text digest of the hot spots for the admin /stats command
+    uptime = int(time.time() - started_at)
+    lines = [
+        f"Uptime: {uptime // 3600}h {uptime // 60 % 60}m",
+        f"Updates in flight: {UPDATES_IN_FLIGHT.labels().value:g}, "
+        f"API requests in flight: {API_IN_FLIGHT.labels().value:g}",
+        f"Event loop lag: last {LOOP_LAG_LAST.labels().value * 1000:.1f} ms, "
+        f"p99 <= {LOOP_LAG.labels().quantile(0.99) * 1000:g} ms",
+        "",
+        "Handlers (count, p50, p95):",
+    ]
+    for (handler,), child in _top(HANDLER_SECONDS, limit):
+        lines.append(f"  {handler}: {child.count}, {child.quantile(0.5) * 1000:g} / {child.quantile(0.95) * 1000:g} ms")
+
+    lines.append("")
+    lines.append("Adsterra API (count, p50, p95):")
+    for (endpoint,), child in _top(API_SECONDS, limit):
+        lines.append(f"  {endpoint}: {child.count}, {child.quantile(0.5) * 1000:g} / {child.quantile(0.95) * 1000:g} ms")
+    errors = sum(child.value for (endpoint, status), child in API_REQUESTS._children.items()
+                 if status == "error" or (status.isdigit() and int(status) >= 400))
+    lines.append(f"  failed attempts: {errors:g}")
+
+    lines.append("")
+    lines.append("Database (count, p95):")
+    for (db, query), child in _top(DB_SECONDS, limit):
+        lines.append(f"  {db}.{query}: {child.count}, {child.quantile(0.95) * 1000:g} ms")
+
+    lines.append("")
+    lines.append("Caches (hit ratio, entries):")
+    for name, cache in caches.items():
+        stats = cache.stats()
+        lines.append(f"  {name}: {stats['hit_ratio']:.0%}, {stats['size']}")
+    return "\n".join(lines)
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return ("\n".join(lines) + "\n").encode()
+
+async def handle_metrics(request):
+    return 200, "text/plain; version=0.0.4", render()
@@ -0,0 +1,72 @@
+import asyncio
+import sys
+from contextlib import asynccontextmanager
+
+from telegram import Update
+from telegram.ext import Application
+
+class KeyedLocks:
+    # One asyncio.Lock per key, dropped again once nobody holds or waits for it
+
+    def __init__(self):
+        self._locks = {}  # key -> [lock, users]
+
+    def __len__(self):
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+update_locks = KeyedLocks()
+
+def update_key(update):
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user:
+        return ('user', update.effective_user.id)
+    if update.effective_chat:
+        return ('chat', update.effective_chat.id)
+    return None
+
+class OrderedApplication(Application):
+    # With concurrent_updates, PTB runs every update in its own task. Updates of
+    # the same user are still handled one after another here, in arrival order
+    # (asyncio.Lock is FIFO), so ConversationHandler state and filter writes
+    # never interleave, while different users proceed in parallel.
+    #
+    # PTB takes a slot of its concurrent_updates semaphore before calling
+    # process_update, so updates waiting behind their user's lock would each
+    # hold one, and one user with a backlog of taps could stall everybody.
+    # PTB's own limit is lifted for that reason, and the configured one is
+    # applied here instead, only to updates whose turn it is.
+
+    def __init__(self, *, concurrent_updates, **kwargs):
+        limit = 256 if concurrent_updates is True else int(concurrent_updates or 0)
+        super().__init__(concurrent_updates=sys.maxsize if limit else 0, **kwargs)
+        self._update_limit = limit
+        self._update_slots = asyncio.Semaphore(limit or 1)
+
+    @property
+    def concurrent_updates(self):
+        return self._update_limit
+
+    async def process_update(self, update):
+        key = update_key(update)
+        if key is None:
+            async with self._update_slots:
+                return await super().process_update(update)
+
+        async with update_locks.hold(key):
+            async with self._update_slots:
+                return await super().process_update(update)
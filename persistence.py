@@ -0,0 +1,137 @@
+import asyncio
+import logging
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from state import backend as default_backend
+
+logger = logging.getLogger(__name__)
+
+class BackendPersistence(BasePersistence):
+    # PTB persistence on top of the state backend, so a restart or deploy
+    # resumes every user in the conversation step they were in. It is not a
+    # way to share conversations between workers: PTB reads them once, at
+    # initialize(), and keeps its own copy.
+    #
+    # Everything is loaded with one query per kind at startup. Updates are only
+    # buffered: PTB hands over all changes of one persistence run at once, and a
+    # single write after `flush_delay` saves the whole batch. Data that didn't
+    # change since the last write is skipped.
+
+    def __init__(self, backend=None, update_interval=5, flush_delay=0.5):
+        super().__init__(
+            store_data=PersistenceInput(callback_data=False),
+            update_interval=update_interval
+        )
+        self.backend = backend or default_backend
+        self.flush_delay = flush_delay
+        self._saved = {'user': {}, 'chat': {}, 'bot': {}}
+        self._pending_data = {'user': {}, 'chat': {}, 'bot': {}}
+        self._pending_conversations = {}
+        self._write_task = None
+
+    async def _load(self, kind):
+        data = await self.backend.load_persistent_data(kind)
+        self._saved[kind] = data
+        return {id: dict(value) for id, value in data.items()}
+
+    async def get_user_data(self):
+        return await self._load('user')
+
+    async def get_chat_data(self):
+        return await self._load('chat')
+
+    async def get_bot_data(self):
+        data = await self._load('bot')
+        return data.get(0, {})
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return await self.backend.load_conversations(name)
+
+    def _stage(self, kind, id, data):
+        # PTB already passes a deep copy
+        if data is not None and self._saved[kind].get(id) == data:
+            self._pending_data[kind].pop(id, None)
+            return
+        self._pending_data[kind][id] = data
+        self._schedule_write()
+
+    async def update_user_data(self, user_id, data):
+        self._stage('user', user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._stage('chat', chat_id, data)
+
+    async def update_bot_data(self, data):
+        self._stage('bot', 0, data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        self._stage('user', user_id, None)
+
+    async def drop_chat_data(self, chat_id):
+        self._stage('chat', chat_id, None)
+
+    async def update_conversation(self, name, key, new_state):
+        self._pending_conversations.setdefault(name, {})[key] = new_state
+        self._schedule_write()
+
+    # Not pulled in between: this process's copy is the current one as long as
+    # a user's updates always reach the same worker. With several workers that
+    # has to hold for conversations anyway, since PTB can't refresh those.
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    def _schedule_write(self):
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.get_running_loop().create_task(self._delayed_write())
+
+    async def _delayed_write(self):
+        await asyncio.sleep(self.flush_delay)
+        try:
+            await self._write()
+        except Exception:
+            logger.exception("Saving persistence failed, retrying on the next update")
+
+    async def _write(self):
+        # Swap the buffers before awaiting, later changes go into the next batch
+        data, self._pending_data = self._pending_data, {'user': {}, 'chat': {}, 'bot': {}}
+        conversations, self._pending_conversations = self._pending_conversations, {}
+
+        try:
+            for kind, changes in data.items():
+                if changes:
+                    await self.backend.save_persistent_data(kind, changes)
+                    for id, value in changes.items():
+                        if value is None:
+                            self._saved[kind].pop(id, None)
+                        else:
+                            self._saved[kind][id] = value
+                    data[kind] = {}
+            for name, changes in list(conversations.items()):
+                await self.backend.save_conversations(name, changes)
+                del conversations[name]
+        except Exception:
+            # Put back whatever wasn't saved, without overwriting newer changes
+            for kind, changes in data.items():
+                self._pending_data[kind] = {**changes, **self._pending_data[kind]}
+            for name, changes in conversations.items():
+                self._pending_conversations[name] = {**changes, **self._pending_conversations.get(name, {})}
+            raise
+
+    async def flush(self):
+        # Called by PTB on shutdown, after the last update run
+        if self._write_task is not None:
+            await asyncio.gather(self._write_task, return_exceptions=True)
+        await self._write()
@@ -0,0 +1,78 @@
+import logging
+import time
+
+import catalog
+import reports
+import tenants
+from config import (
+    PREWARM_TICK,
+    PREWARM_MIN_INTERVAL,
+    PREWARM_MAX_INTERVAL,
+    PREWARM_MAX_PER_TICK
+)
+from state import backend
+from adsterra_api import stats_ttl
+
+logger = logging.getLogger(__name__)
+
+# (tenant, preset, domain, placement, group_by) -> monotonic time of the last refresh
+last_warmed = {}
+
+def refresh_interval(score):
+    # Popular combinations are refreshed every PREWARM_MIN_INTERVAL seconds,
+    # ones nobody asks for fall back to PREWARM_MAX_INTERVAL
+    return max(PREWARM_MIN_INTERVAL, min(PREWARM_MAX_INTERVAL, PREWARM_MAX_INTERVAL / (1 + score)))
+
+async def candidates():
+    stored = await backend.get_filter_combinations()
+    keys = set()
+    for tenant in tenants.all_tenants():
+        with tenants.using(tenant):
+            domains = catalog.domain_names()
+
+        combinations = {(None, None, 'date')}
+        combinations.update((domain, None, 'date') for domain in domains)
+        # Stored filters aren't kept per tenant, a domain tells whose they are
+        combinations.update(
+            combination for combination in stored
+            if combination[0] is None or combination[0] in domains
+        )
+
+        keys.update(
+            (tenant.id, preset, domain, placement, group_by or 'date')
+            for preset in reports.PRESETS
+            for domain, placement, group_by in combinations
+            # Breakdowns cost one request per domain/placement, too much to prefetch
+            if (group_by or 'date') not in reports.BREAKDOWN_GROUPS
+        )
+    return keys
+
+async def warm():
+    now = time.monotonic()
+    due = []
+    for key in await candidates():
+        score = reports.demand_score(key, now)
+        interval = refresh_interval(score)
+        if now - last_warmed.get(key, 0) >= interval:
+            due.append((score, interval, key))
+
+    # Most requested first, and never more than PREWARM_MAX_PER_TICK upstream loads
+    due.sort(key=lambda entry: entry[0], reverse=True)
+    for score, interval, key in due[:PREWARM_MAX_PER_TICK]:
+        tenant_id, preset, domain, placement, group_by = key
+        tenant = tenants.get(tenant_id)
+        if tenant is None:
+            continue
+        start, end = reports.get_preset_dates(preset)
+        # Keep the entry alive until the next refresh is due
+        ttl = max(stats_ttl(end.isoformat()), interval + PREWARM_TICK)
+
+        with tenants.using(tenant):
+            stats = await reports.load_stats(
+                start.isoformat(), end.isoformat(), domain, placement, group_by, refresh=True, ttl=ttl
+            )
+        if stats is not None:
+            last_warmed[key] = time.monotonic()
+
+    if due:
+        logger.info("Prewarmed %d of %d due report(s)", min(len(due), PREWARM_MAX_PER_TICK), len(due))
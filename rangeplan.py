@@ -0,0 +1,130 @@
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+
+from aggregate import DERIVED, Columns, group
+from cache import TTLCache
+from metrics import register_cache
+from config import DAY_CACHE_SIZE, FANOUT_CONCURRENCY, STATS_CACHE_TTL_CLOSED, STREAM_MIN_DAYS
+from adsterra_api import fetch_stats, fetch_stats_streamed, get_stats, stats_cache_key
+from warehouse import MUTABLE_DAYS, contiguous_runs
+
+logger = logging.getLogger(__name__)
+
+# Report groupings that can be rebuilt from per-day rows
+PLANNED_GROUPS = ('date', 'week', 'month', 'country')
+
+# (day, domain, placement, requested dims) -> that day's rows, for finished
+# days only. Date, week and month reports share the same per-day rows.
+day_cache = TTLCache(maxsize=DAY_CACHE_SIZE, default_ttl=STATS_CACHE_TTL_CLOSED)
+register_cache("days", day_cache)
+
+_inflight = {}
+
+def plan_range(start_date, end_date, today=None):
+    # -> (past days, (tail_start, tail_end) or None). Past days are final and
+    # cached per day, the tail still changes and goes through get_stats.
+    # Missing dates mean today, like unset report filters
+    today = today or datetime.now().date()
+    start = date.fromisoformat(str(start_date)) if start_date else today
+    end = date.fromisoformat(str(end_date)) if end_date else today
+    mutable_from = today - timedelta(days=MUTABLE_DAYS - 1)
+
+    past = []
+    day = start
+    while day <= end and day < mutable_from:
+        past.append(day)
+        day += timedelta(days=1)
+
+    tail = (max(start, mutable_from), end) if end >= mutable_from else None
+    return past, tail
+
+def _request_dims(group_by):
+    # Weeks and months are derived from the day, everything else is requested per day
+    if group_by == 'date' or group_by in DERIVED:
+        return 'date'
+    return ['date', group_by]
+
+def _day_rows(items, group_by):
+    # Keep only what the merge needs: the day, the group column and the metrics
+    rows = {}
+    for item in items:
+        row = {
+            'date': item.get('date'),
+            'impression': item.get('impression', 0),
+            'clicks': item.get('clicks', 0),
+            'revenue': item.get('revenue', 0),
+        }
+        if _request_dims(group_by) != 'date':
+            row[group_by] = item.get(group_by)
+        rows.setdefault(row['date'], []).append(row)
+    return rows
+
+async def _fetch_gap(start, end, domain, placement, group_by):
+    # One upstream request for a run of uncached days; empty days are cached
+    # too, so they don't count as gaps next time
+    dims = _request_dims(group_by)
+    fetch = fetch_stats_streamed if (end - start).days + 1 >= STREAM_MIN_DAYS else fetch_stats
+    stats = await fetch(start.isoformat(), end.isoformat(), domain, placement, dims)
+    if stats is None:
+        return False
+
+    rows = _day_rows(stats.get('items') or [], group_by)
+    day = start
+    while day <= end:
+        day_cache.set(stats_cache_key(day, day, domain, placement, _request_dims(group_by)), rows.get(day.isoformat(), []))
+        day += timedelta(days=1)
+    return True
+
+def _gap_task(start, end, domain, placement, group_by):
+    # Identical gaps from concurrent reports share one request
+    key = stats_cache_key(start, end, domain, placement, _request_dims(group_by))
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_gap(start, end, domain, placement, group_by))
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+        _inflight[key] = task
+    return asyncio.shield(task)
+
+async def load_planned(start_date, end_date, domain=None, placement=None, group_by="date", refresh=False, ttl=None):
+    past, tail = plan_range(start_date, end_date)
+    if not past and group_by not in DERIVED:
+        # Nothing final to reuse (e.g. today only)
+        return await get_stats(start_date, end_date, domain, placement, group_by, refresh=refresh, ttl=ttl)
+
+    missing = [
+        day for day in past
+        if day_cache.lookup(stats_cache_key(day, day, domain, placement, _request_dims(group_by))) is None
+    ]
+    gaps = contiguous_runs(missing)
+
+    semaphore = asyncio.Semaphore(FANOUT_CONCURRENCY)
+
+    async def fill(start, end):
+        async with semaphore:
+            return await _gap_task(start, end, domain, placement, group_by)
+
+    async def load_tail():
+        if tail is None:
+            return {'items': []}
+        return await get_stats(tail[0].isoformat(), tail[1].isoformat(), domain, placement, _request_dims(group_by),
+                               refresh=refresh, ttl=ttl)
+
+    *filled, tail_stats = await asyncio.gather(*(fill(start, end) for start, end in gaps), load_tail())
+    if not all(filled) or tail_stats is None:
+        return None
+
+    items = []
+    for day in past:
+        rows = day_cache.get(stats_cache_key(day, day, domain, placement, _request_dims(group_by)))
+        if rows is None:
+            # Evicted while the gaps were being filled, rare enough to just give up
+            return None
+        items.extend(rows)
+    items.extend(tail_stats.get('items') or [])
+
+    logger.debug("Range %s..%s: %d cached day(s), %d gap request(s)",
+                 start_date, end_date, len(past) - len(missing), len(gaps))
+
+    dims = ('date',) if _request_dims(group_by) == 'date' else ('date', group_by)
+    return {'items': group(Columns.from_items(items, dims=dims), group_by)}
@@ -0,0 +1,121 @@
+import time
+from datetime import datetime, timedelta
+
+import catalog
+import tenants
+import warehouse
+from aggregate import Columns, group, merge
+from config import PREWARM_DEMAND_HALF_LIFE
+from adsterra_api import get_stats, get_stats_breakdown
+from rangeplan import PLANNED_GROUPS, load_planned, plan_range
+
+# Report groupings that need one upstream request per domain/placement
+BREAKDOWN_GROUPS = ('domain', 'placement')
+
+PRESETS = ('today', 'yesterday', 'last7', 'last30', 'thismonth', 'thisyear')
+
+# How often each (tenant, preset, domain, placement, group_by) is asked for, as an
+# exponentially decaying score: key -> (score, last_update)
+demand = {}
+
+def get_preset_dates(preset):
+    today = datetime.now().date()
+    
+    if preset == "today":
+        return today, today
+    elif preset == "yesterday":
+        yesterday = today - timedelta(days=1)
+        return yesterday, yesterday
+    elif preset == "last7":
+        return today - timedelta(days=6), today
+    elif preset == "last30":
+        return today - timedelta(days=29), today
+    elif preset == "thismonth":
+        start = today.replace(day=1)
+        return start, today
+    elif preset == "thisyear":
+        start = today.replace(month=1, day=1)
+        return start, today
+    else:
+        return today, today
+
+def preset_for(start_date, end_date):
+    for preset in PRESETS:
+        start, end = get_preset_dates(preset)
+        if (start.isoformat(), end.isoformat()) == (str(start_date), str(end_date)):
+            return preset
+    return None
+
+def demand_score(key, now=None):
+    now = now or time.monotonic()
+    score, updated = demand.get(key, (0.0, now))
+    return score * 0.5 ** ((now - updated) / PREWARM_DEMAND_HALF_LIFE)
+
+def record_demand(start_date, end_date, domain, placement, group_by):
+    preset = preset_for(start_date, end_date)
+    if preset is None:
+        return
+    key = (tenants.active().id, preset, domain, placement, group_by)
+    now = time.monotonic()
+    demand[key] = (demand_score(key, now) + 1, now)
+
+async def load_stats(start_date, end_date, domain=None, placement=None, group_by="date", refresh=False, ttl=None):
+    # Unset dates (filters without a chosen range) mean today
+    today = datetime.now().date().isoformat()
+    start_date = str(start_date or today)
+    end_date = str(end_date or today)
+    if not refresh:
+        record_demand(start_date, end_date, domain, placement, group_by)
+
+    # Finished days are answered from the local warehouse when it has them. The
+    # last MUTABLE_DAYS still change and always come from the API (and its
+    # caches), then both parts are merged.
+    past, tail = plan_range(start_date, end_date)
+    if past:
+        stats = await warehouse.query_stats(past[0].isoformat(), past[-1].isoformat(), domain, placement, group_by)
+        if stats is not None:
+            if tail is None:
+                return stats
+            live = await load_live(tail[0].isoformat(), tail[1].isoformat(), domain, placement, group_by,
+                                   refresh=refresh, ttl=ttl)
+            if live is None:
+                return None
+            merged = dict(live)
+            merged['items'] = merge([stats['items'], live.get('items') or []], group_by)
+            return merged
+
+    return await load_live(start_date, end_date, domain, placement, group_by, refresh=refresh, ttl=ttl)
+
+async def load_live(start_date, end_date, domain=None, placement=None, group_by="date", refresh=False, ttl=None):
+    if group_by in BREAKDOWN_GROUPS:
+        return await load_breakdown(start_date, end_date, domain, placement, group_by)
+
+    if group_by in PLANNED_GROUPS:
+        return await load_planned(start_date, end_date, domain, placement, group_by, refresh=refresh, ttl=ttl)
+
+    return await get_stats(start_date, end_date, domain, placement, group_by, refresh=refresh, ttl=ttl)
+
+async def load_breakdown(start_date, end_date, domain=None, placement=None, group_by="domain"):
+    domains = [domain] if domain else list(catalog.domain_names())
+    names = {}
+
+    if group_by == 'domain' or placement:
+        targets = [(domain_id, placement) for domain_id in domains]
+    else:
+        placements = await catalog.placements_for(domains)
+        targets = []
+        for domain_id in domains:
+            for item in placements[domain_id]:
+                targets.append((domain_id, item.get('id')))
+                names[item.get('id')] = item.get('alias') or item.get('title')
+
+    breakdown = await get_stats_breakdown(start_date, end_date, targets)
+    if breakdown['failed'] and len(breakdown['failed']) == len(targets):
+        return None
+
+    # Collapse the per-day rows of each target into one row per domain/placement
+    columns = Columns.from_items(breakdown['items'])
+    columns.extra.update(names)
+    items = group(columns, group_by)
+
+    return {'items': items, 'failed': breakdown['failed'], 'requests': breakdown['requests']}
@@ -0,0 +1,194 @@
+import asyncio
+import random
+import re
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+from metrics import API_IN_FLIGHT, API_REQUESTS, API_SECONDS
+
+class CircuitOpenError(Exception):
+    pass
+
+class UpstreamError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"Upstream returned HTTP {status_code}")
+        self.status_code = status_code
+
+class TokenBucket:
+    # Client-side rate limiter. The refill rate backs off on 429 and creeps back
+    # up to the configured quota on successful calls (AIMD).
+
+    def __init__(self, rate, capacity, min_rate=0.2):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        # The lock keeps waiters in FIFO order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def throttle(self, retry_after=None):
+        self.rate = max(self.min_rate, self.rate / 2)
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+    def recover(self):
+        self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+class CircuitBreaker:
+    # Opens after `failure_threshold` consecutive failures and fails fast until
+    # `reset_timeout` has passed, then lets a single trial call through.
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def check(self):
+        # -> True when the caller got the half-open trial, which it must end
+        # with record_success, record_failure or release_trial
+        state = self.state
+        if state == "open" or (state == "half_open" and self.trial_running):
+            raise CircuitOpenError("Adsterra API circuit is open")
+        if state == "half_open":
+            self.trial_running = True
+            return True
+        return False
+
+    def release_trial(self):
+        # The trial told nothing about upstream health, the next call tries again
+        self.trial_running = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_running = False
+        if self.failures >= self.failure_threshold or self.opened_at is not None:
+            self.opened_at = time.monotonic()
+
+def backoff_delay(attempt, base, cap):
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def retry_after_seconds(response):
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def endpoint_label(url):
+    # "/domain/123/placements.json" -> "/domain/{id}/placements.json"
+    return re.sub(r"/\d+", "/{id}", str(url))
+
+class RetryingClient:
+    # Every Adsterra call goes through send(): rate limit, circuit breaker, and
+    # retries with backoff on 429, 5xx and transport errors.
+
+    def __init__(self, limiter, breaker, attempts=3, base_delay=0.5, max_delay=30):
+        self.limiter = limiter
+        self.breaker = breaker
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    async def send(self, client, method, url, stream=False, **kwargs):
+        # With stream=True the body is not read; the caller must aclose() the response
+        trial = self.breaker.check()
+        endpoint = endpoint_label(url)
+        try:
+            return await self._send(client, method, url, stream, endpoint, **kwargs)
+        except UpstreamError as e:
+            if trial and e.status_code == 429:
+                self.breaker.release_trial()
+            raise
+        finally:
+            # Anything the attempts don't handle (a decoding error, too many
+            # redirects, cancellation) must not keep the trial taken forever
+            if trial and self.breaker.trial_running:
+                self.breaker.record_failure()
+
+    async def _send(self, client, method, url, stream, endpoint, **kwargs):
+        for attempt in range(self.attempts + 1):
+            await self.limiter.acquire()
+            try:
+                request = client.build_request(method, url, **kwargs)
+                API_IN_FLIGHT.inc()
+                start = time.perf_counter()
+                try:
+                    response = await client.send(request, stream=stream)
+                finally:
+                    API_IN_FLIGHT.dec()
+                    API_SECONDS.labels(endpoint).observe(time.perf_counter() - start)
+            except httpx.TransportError as e:
+                API_REQUESTS.labels(endpoint, "error").inc()
+                error = e
+                delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+            else:
+                status = response.status_code
+                API_REQUESTS.labels(endpoint, str(status)).inc()
+                if status != 429 and status < 500:
+                    self.breaker.record_success()
+                    self.limiter.recover()
+                    return response
+
+                await response.aclose()
+                error = UpstreamError(status)
+                retry_after = retry_after_seconds(response)
+                if status == 429:
+                    self.limiter.throttle(retry_after)
+                delay = retry_after if retry_after is not None else backoff_delay(
+                    attempt, self.base_delay, self.max_delay
+                )
+
+            if attempt == self.attempts or delay > self.max_delay:
+                break
+            await asyncio.sleep(delay)
+
+        # Quota exhaustion says nothing about upstream health
+        if not (isinstance(error, UpstreamError) and error.status_code == 429):
+            self.breaker.record_failure()
+        raise error
@@ -0,0 +1,35 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Background jobs started from post_init and cancelled in post_shutdown
+_tasks = []
+
+def run_periodic(interval, func, *args, name=None, first_delay=0):
+    task = asyncio.get_running_loop().create_task(
+        _loop(interval, func, args, first_delay),
+        name=name or func.__name__
+    )
+    _tasks.append(task)
+    return task
+
+async def _loop(interval, func, args, first_delay):
+    if first_delay:
+        await asyncio.sleep(first_delay)
+
+    while True:
+        try:
+            await func(*args)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Background job %s failed", func.__name__)
+
+        await asyncio.sleep(interval() if callable(interval) else interval)
+
+async def stop():
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
@@ -0,0 +1,79 @@
+# Manage tenants (Adsterra accounts) and bot logins in the state backend.
+#
+#   python scripts/manage_tenants.py list
+#   python scripts/manage_tenants.py add-tenant "Acme Media" API_KEY [--rate-limit 5] [--rate-burst 10]
+#   python scripts/manage_tenants.py add-user alice 2        (prompts for the password)
+#
+# Running bots pick up new or changed tenants within TENANT_REFRESH_INTERVAL.
+
+import argparse
+import asyncio
+import getpass
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tenants
+from state import backend
+
+async def list_tenants(args):
+    for tenant in await backend.get_tenants():
+        print(f"{tenant['id']}: {tenant['name']} (rate limit {tenant['rate_limit'] or 'default'}/s, "
+              f"burst {tenant['rate_burst'] or 'default'}, {len(tenant['domains'])} configured domain(s))")
+
+async def add_tenant(args):
+    # Updating keeps the configured domains, and the rate settings not given
+    existing = {tenant['id']: tenant for tenant in await backend.get_tenants()}.get(args.id) or {}
+    tenant_id = await backend.save_tenant({
+        'id': args.id,
+        'name': args.name,
+        'api_key': args.api_key,
+        'rate_limit': args.rate_limit if args.rate_limit is not None else existing.get('rate_limit'),
+        'rate_burst': args.rate_burst if args.rate_burst is not None else existing.get('rate_burst'),
+        'domains': existing.get('domains') or {}
+    })
+    print(f"Saved tenant {tenant_id}: {args.name}")
+
+async def add_user(args):
+    if args.tenant_id not in {tenant['id'] for tenant in await backend.get_tenants()}:
+        print(f"No tenant {args.tenant_id}, see `list`")
+        sys.exit(1)
+    password = args.password or getpass.getpass(f"Password for {args.username}: ")
+    await backend.save_account(args.username, tenants.hash_password(password), args.tenant_id)
+    print(f"Saved login {args.username} for tenant {args.tenant_id}")
+
+async def run(args):
+    try:
+        # Creates the default tenant from config.py first, as the bot would
+        await tenants.load()
+        await args.func(args)
+    finally:
+        await backend.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(required=True)
+
+    command = commands.add_parser("list")
+    command.set_defaults(func=list_tenants)
+
+    command = commands.add_parser("add-tenant", help="add a tenant, or update one with --id")
+    command.add_argument("name")
+    command.add_argument("api_key")
+    command.add_argument("--id", type=int)
+    command.add_argument("--rate-limit", type=float, help="requests per second, default ADSTERRA_RATE_LIMIT")
+    command.add_argument("--rate-burst", type=int, help="default ADSTERRA_RATE_BURST")
+    command.set_defaults(func=add_tenant)
+
+    command = commands.add_parser("add-user", help="add a login, or change its password or tenant")
+    command.add_argument("username")
+    command.add_argument("tenant_id", type=int)
+    command.add_argument("--password", help="prompted for when omitted")
+    command.set_defaults(func=add_user)
+
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+# Post recorded Telegram update JSON to a locally running webhook.
+#
+#   BOT_MODE=webhook python bot.py
+#   python scripts/post_update.py update.json [more.json ...]
+#
+# Each file holds one update object or a list of them, as returned by getUpdates.
+
+import json
+import os
+import sys
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__ or "usage: post_update.py update.json [...]")
+        sys.exit(1)
+
+    url = f"http://127.0.0.1:{WEBHOOK_PORT}/{WEBHOOK_PATH.strip('/')}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET} if WEBHOOK_SECRET else {}
+
+    with httpx.Client(timeout=10) as client:
+        for path in sys.argv[1:]:
+            with open(path) as f:
+                data = json.load(f)
+            updates = data if isinstance(data, list) else [data]
+            for update in updates:
+                response = client.post(url, json=update, headers=headers)
+                print(f"{path}: update {update.get('update_id')} -> {response.status_code}")
+
+if __name__ == '__main__':
+    main()
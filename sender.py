@@ -0,0 +1,104 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+
+from resilience import TokenBucket, backoff_delay
+
+logger = logging.getLogger(__name__)
+
+class MessageSender:
+    # Outgoing queue for bulk messages (digests, alerts). Messages to the same
+    # chat are spaced by `per_chat_interval`, all chats together are capped by a
+    # token bucket, and Telegram's RetryAfter puts the message back in the queue.
+
+    def __init__(self, bot, rate=25, per_chat_interval=1.0, concurrency=4, attempts=5):
+        self.bot = bot
+        self.limiter = TokenBucket(rate, rate)
+        self.per_chat_interval = per_chat_interval
+        self.attempts = attempts
+        self.sent = 0
+        self.failed = 0
+        self._heap = []  # (ready_at, seq, chat_id, text, kwargs, attempt)
+        self._seq = itertools.count()
+        self._next_slot = {}
+        self._prune_at = 1024
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(concurrency)
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(), name="message_sender")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def pending(self):
+        return len(self._heap)
+
+    def send_message(self, chat_id, text, **kwargs):
+        now = time.monotonic()
+        if len(self._next_slot) >= self._prune_at:
+            self._prune_slots(now)
+        ready_at = max(now, self._next_slot.get(chat_id, 0))
+        self._next_slot[chat_id] = ready_at + self.per_chat_interval
+        self._push(ready_at, chat_id, text, kwargs, 0)
+
+    def _prune_slots(self, now):
+        # Slots already in the past don't delay anything; forget those chats.
+        # Pruning again only once the map has doubled keeps sends amortized O(1).
+        self._next_slot = {chat: slot for chat, slot in self._next_slot.items() if slot > now}
+        self._prune_at = max(1024, 2 * len(self._next_slot))
+
+    def _push(self, ready_at, chat_id, text, kwargs, attempt):
+        heapq.heappush(self._heap, (ready_at, next(self._seq), chat_id, text, kwargs, attempt))
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            delay = self._heap[0][0] - time.monotonic() if self._heap else None
+            if delay is None or delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            item = heapq.heappop(self._heap)
+            await self._slots.acquire()
+            await self.limiter.acquire()
+            asyncio.get_running_loop().create_task(self._deliver(*item[2:]))
+
+    async def _deliver(self, chat_id, text, kwargs, attempt):
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            self.sent += 1
+            self.limiter.recover()
+        except RetryAfter as e:
+            self.limiter.throttle(e.retry_after)
+            self._retry(time.monotonic() + e.retry_after, chat_id, text, kwargs, attempt)
+        except (Forbidden, BadRequest) as e:
+            # Blocked bot, deleted chat, bad markup: retrying won't help
+            self.failed += 1
+            logger.warning("Dropping message to chat %s: %s", chat_id, e)
+        except TelegramError as e:
+            logger.warning("Send to chat %s failed: %s", chat_id, e)
+            self._retry(time.monotonic() + backoff_delay(attempt, 1, 60), chat_id, text, kwargs, attempt)
+        finally:
+            self._slots.release()
+
+    def _retry(self, ready_at, chat_id, text, kwargs, attempt):
+        if attempt + 1 >= self.attempts:
+            self.failed += 1
+            logger.warning("Giving up on message to chat %s", chat_id)
+            return
+        self._next_slot[chat_id] = max(self._next_slot.get(chat_id, 0), ready_at + self.per_chat_interval)
+        self._push(ready_at, chat_id, text, kwargs, attempt + 1)
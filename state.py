@@ -0,0 +1,356 @@
+import json
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+import database
+from config import STATE_BACKEND, REDIS_URL
+
+class StateBackend(ABC):
+    # Everything a bot worker keeps between updates: sessions, filters, digest
+    # subscriptions, ConversationHandler state and the shared report cache.
+    # Workers that share a backend share sessions, filters, subscriptions,
+    # tenants, alerts, the report cache and job locks. Conversation state and
+    # user_data are only read at startup (see persistence.py), so each user's
+    # updates must keep reaching the same worker.
+
+    # Whether cache_get/cache_set are visible to other workers
+    shares_cache = False
+
+    @abstractmethod
+    async def get_user_session(self, user_id): ...
+
+    @abstractmethod
+    async def create_session(self, user_id, username, tenant_id=None): ...
+
+    @abstractmethod
+    async def delete_session(self, user_id): ...
+
+    @abstractmethod
+    async def get_user_filters(self, user_id): ...
+
+    @abstractmethod
+    async def update_user_filters(self, user_id, **filters): ...
+
+    @abstractmethod
+    async def get_filter_combinations(self): ...
+
+    @abstractmethod
+    async def subscribe_digest(self, user_id, chat_id, frequency): ...
+
+    @abstractmethod
+    async def unsubscribe_digest(self, user_id, frequency=None): ...
+
+    @abstractmethod
+    async def get_digest_subscriptions(self, frequency): ...
+
+    @abstractmethod
+    async def get_tenants(self): ...
+
+    @abstractmethod
+    async def save_tenant(self, tenant): ...
+
+    @abstractmethod
+    async def get_account(self, username): ...
+
+    @abstractmethod
+    async def save_account(self, username, password_hash, tenant_id): ...
+
+    @abstractmethod
+    async def get_alert_rules(self, user_id=None): ...
+
+    @abstractmethod
+    async def add_alert_rule(self, rule): ...
+
+    @abstractmethod
+    async def delete_alert_rule(self, user_id, rule_id): ...
+
+    @abstractmethod
+    async def set_alert_state(self, rule_id, state, day): ...
+
+    @abstractmethod
+    async def load_conversations(self, name): ...
+
+    @abstractmethod
+    async def save_conversations(self, name, changes): ...
+
+    @abstractmethod
+    async def load_persistent_data(self, kind): ...
+
+    @abstractmethod
+    async def save_persistent_data(self, kind, changes): ...
+
+    async def cache_get(self, namespace, key):
+        return None
+
+    async def cache_set(self, namespace, key, value, ttl):
+        pass
+
+    async def acquire_lock(self, name, ttl):
+        # Guards jobs that must run on one worker only (digests, alerts)
+        return True
+
+    async def flush(self):
+        pass
+
+    async def close(self):
+        pass
+
+class SQLiteBackend(StateBackend):
+    # The local sessions.db with its in-memory write-back cache, single worker only
+
+    async def get_user_session(self, user_id):
+        return await database.get_user_session(user_id)
+
+    async def create_session(self, user_id, username, tenant_id=None):
+        await database.create_session(user_id, username, tenant_id)
+
+    async def delete_session(self, user_id):
+        await database.delete_session(user_id)
+
+    async def get_user_filters(self, user_id):
+        return await database.get_user_filters(user_id)
+
+    async def update_user_filters(self, user_id, **filters):
+        return await database.update_user_filters(user_id, **filters)
+
+    async def get_filter_combinations(self):
+        return await database.get_filter_combinations()
+
+    async def subscribe_digest(self, user_id, chat_id, frequency):
+        await database.subscribe_digest(user_id, chat_id, frequency)
+
+    async def unsubscribe_digest(self, user_id, frequency=None):
+        await database.unsubscribe_digest(user_id, frequency)
+
+    async def get_digest_subscriptions(self, frequency):
+        return await database.get_digest_subscriptions(frequency)
+
+    async def get_tenants(self):
+        return await database.get_tenants()
+
+    async def save_tenant(self, tenant):
+        return await database.save_tenant(tenant)
+
+    async def get_account(self, username):
+        return await database.get_account(username)
+
+    async def save_account(self, username, password_hash, tenant_id):
+        await database.save_account(username, password_hash, tenant_id)
+
+    async def get_alert_rules(self, user_id=None):
+        return await database.get_alert_rules(user_id)
+
+    async def add_alert_rule(self, rule):
+        return await database.add_alert_rule(rule)
+
+    async def delete_alert_rule(self, user_id, rule_id):
+        return await database.delete_alert_rule(user_id, rule_id)
+
+    async def set_alert_state(self, rule_id, state, day):
+        await database.set_alert_state(rule_id, state, day)
+
+    async def load_conversations(self, name):
+        return await database.load_conversations(name)
+
+    async def save_conversations(self, name, changes):
+        await database.save_conversations(name, changes)
+
+    async def load_persistent_data(self, kind):
+        return await database.load_persistent_data(kind)
+
+    async def save_persistent_data(self, kind, changes):
+        await database.save_persistent_data(kind, changes)
+
+    async def flush(self):
+        await database.flush_user_state()
+
+    async def close(self):
+        await database.flush_user_state()
+        database.close_db()
+
+class RedisBackend(StateBackend):
+    # Networked backend for several workers, within the limits above. Takes any
+    # redis.asyncio-compatible client created with decode_responses=True
+    # (fakeredis works for tests).
+
+    shares_cache = True
+
+    def __init__(self, client, prefix="adsterra"):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("STATE_BACKEND=redis needs the redis package (pip install redis)")
+        return cls(redis.from_url(url, decode_responses=True))
+
+    def _key(self, *parts):
+        return ":".join((self.prefix, *(str(part) for part in parts)))
+
+    async def get_user_session(self, user_id):
+        data = await self.client.hgetall(self._key("session", user_id))
+        if not data:
+            return None
+        tenant_id = int(data["tenant_id"]) if data.get("tenant_id") else None
+        return (user_id, data["username"], data["login_time"], data["last_activity"], tenant_id)
+
+    async def create_session(self, user_id, username, tenant_id=None):
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        await self.client.hset(self._key("session", user_id), mapping={
+            "username": username,
+            "login_time": now,
+            "last_activity": now,
+            "tenant_id": tenant_id or ""
+        })
+
+    async def delete_session(self, user_id):
+        await self.client.delete(self._key("session", user_id))
+
+    def _decode_filters(self, data):
+        filters = dict(database.DEFAULT_FILTERS)
+        filters.update({field: json.loads(value) for field, value in data.items()})
+        return filters
+
+    async def get_user_filters(self, user_id):
+        data = await self.client.hgetall(self._key("filters", user_id))
+        return self._decode_filters(data) if data else None
+
+    async def update_user_filters(self, user_id, **filters):
+        # Only the changed fields are written, so concurrent updates from
+        # different workers can't overwrite each other's fields
+        key = self._key("filters", user_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping={field: json.dumps(value) for field, value in filters.items()})
+            pipe.hgetall(key)
+            _, data = await pipe.execute()
+
+        merged = self._decode_filters(data)
+        await self.client.sadd(
+            self._key("filter_combinations"),
+            json.dumps([merged["domain"], merged["placement"], merged["group_by"]])
+        )
+        return merged
+
+    async def get_filter_combinations(self):
+        members = await self.client.smembers(self._key("filter_combinations"))
+        return {tuple(json.loads(member)) for member in members}
+
+    async def subscribe_digest(self, user_id, chat_id, frequency):
+        await self.client.hset(self._key("digests", frequency), str(user_id), str(chat_id))
+
+    async def unsubscribe_digest(self, user_id, frequency=None):
+        for name in ([frequency] if frequency else ["daily", "hourly"]):
+            await self.client.hdel(self._key("digests", name), str(user_id))
+
+    async def get_digest_subscriptions(self, frequency):
+        data = await self.client.hgetall(self._key("digests", frequency))
+        return [(int(user_id), int(chat_id)) for user_id, chat_id in data.items()]
+
+    async def get_tenants(self):
+        data = await self.client.hgetall(self._key("tenants"))
+        tenants = []
+        for value in data.values():
+            tenant = json.loads(value)
+            tenant['domains'] = {int(domain_id): title for domain_id, title in (tenant.get('domains') or {}).items()}
+            tenants.append(tenant)
+        return sorted(tenants, key=lambda tenant: tenant['id'])
+
+    async def save_tenant(self, tenant):
+        tenant = dict(tenant)
+        if tenant.get('id') is None:
+            ids = [int(id) for id in await self.client.hkeys(self._key("tenants"))]
+            tenant['id'] = max(ids, default=0) + 1
+        await self.client.hset(self._key("tenants"), str(tenant['id']), json.dumps(tenant))
+        return tenant['id']
+
+    async def get_account(self, username):
+        raw = await self.client.hget(self._key("accounts"), username)
+        return tuple(json.loads(raw)) if raw is not None else None
+
+    async def save_account(self, username, password_hash, tenant_id):
+        await self.client.hset(self._key("accounts"), username, json.dumps([password_hash, tenant_id]))
+
+    async def get_alert_rules(self, user_id=None):
+        data = await self.client.hgetall(self._key("alerts"))
+        rules = [json.loads(value) for value in data.values()]
+        if user_id is not None:
+            rules = [rule for rule in rules if rule['user_id'] == user_id]
+        return sorted(rules, key=lambda rule: rule['id'])
+
+    async def add_alert_rule(self, rule):
+        rule_id = await self.client.incr(self._key("alert_ids"))
+        rule = {field: rule.get(field) for field in database.ALERT_FIELDS}
+        rule.update(id=rule_id, state=rule['state'] or 'ok')
+        await self.client.hset(self._key("alerts"), str(rule_id), json.dumps(rule))
+        return rule_id
+
+    async def delete_alert_rule(self, user_id, rule_id):
+        raw = await self.client.hget(self._key("alerts"), str(rule_id))
+        if raw is None or json.loads(raw)['user_id'] != user_id:
+            return False
+        await self.client.hdel(self._key("alerts"), str(rule_id))
+        return True
+
+    async def set_alert_state(self, rule_id, state, day):
+        raw = await self.client.hget(self._key("alerts"), str(rule_id))
+        if raw is not None:
+            rule = json.loads(raw)
+            rule.update(state=state, state_day=day)
+            await self.client.hset(self._key("alerts"), str(rule_id), json.dumps(rule))
+
+    async def load_conversations(self, name):
+        data = await self.client.hgetall(self._key("conversations", name))
+        return {tuple(json.loads(key)): json.loads(state) for key, state in data.items()}
+
+    async def save_conversations(self, name, changes):
+        key = self._key("conversations", name)
+        async with self.client.pipeline(transaction=True) as pipe:
+            for conversation, state in changes.items():
+                field = json.dumps(list(conversation))
+                if state is None:
+                    pipe.hdel(key, field)
+                else:
+                    pipe.hset(key, field, json.dumps(state))
+            await pipe.execute()
+
+    async def load_persistent_data(self, kind):
+        data = await self.client.hgetall(self._key("data", kind))
+        return {int(id): json.loads(value) for id, value in data.items()}
+
+    async def save_persistent_data(self, kind, changes):
+        key = self._key("data", kind)
+        async with self.client.pipeline(transaction=True) as pipe:
+            for id, data in changes.items():
+                if data is None:
+                    pipe.hdel(key, str(id))
+                else:
+                    pipe.hset(key, str(id), json.dumps(data))
+            await pipe.execute()
+
+    async def cache_get(self, namespace, key):
+        raw = await self.client.get(self._key("cache", namespace, json.dumps(key)))
+        return json.loads(raw) if raw is not None else None
+
+    async def cache_set(self, namespace, key, value, ttl):
+        # Columns and other lazy sequences are stored as plain lists of items
+        raw = json.dumps(value, default=list)
+        await self.client.set(self._key("cache", namespace, json.dumps(key)), raw, ex=max(1, int(ttl)))
+
+    async def acquire_lock(self, name, ttl):
+        return bool(await self.client.set(self._key("lock", name), "1", nx=True, ex=max(1, int(ttl))))
+
+    async def close(self):
+        close = getattr(self.client, "aclose", None) or self.client.close
+        await close()
+
+def create_backend(kind=STATE_BACKEND):
+    if kind == "redis":
+        return RedisBackend.from_url(REDIS_URL)
+    if kind == "sqlite":
+        return SQLiteBackend()
+    raise ValueError(f"Unknown STATE_BACKEND: {kind}")
+
+backend = create_backend()
@@ -0,0 +1,170 @@
+import asyncio
+import contextvars
+import hashlib
+import hmac
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from resilience import CircuitBreaker, RetryingClient, TokenBucket
+from state import backend
+from config import (
+    ADSTERRA_API_KEY,
+    ADSTERRA_RATE_LIMIT,
+    ADSTERRA_RATE_BURST,
+    RETRY_ATTEMPTS,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_DELAY,
+    BREAKER_FAILURES,
+    BREAKER_RESET_TIMEOUT,
+    USER_DB,
+    DOMAINS
+)
+
+logger = logging.getLogger(__name__)
+
+# The account from config.py (ADSTERRA_API_KEY, USER_DB, DOMAINS) becomes this
+# tenant on first start, and owns the sessions that predate tenants
+DEFAULT_TENANT_ID = 1
+
+SCRYPT_N, SCRYPT_R, SCRYPT_P = 2 ** 14, 8, 1
+
+# Each scrypt call takes tens of milliseconds and 16 MB on purpose; two threads
+# keep a burst of logins from eating the CPU and memory of everything else
+_hash_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="scrypt")
+
+class Tenant:
+    # One Adsterra publisher account. Each tenant has its own HTTP connection
+    # pool, rate limit and circuit breaker, so one that burns through its quota
+    # or trips its breaker doesn't hold up the others.
+
+    def __init__(self, id, name, api_key, rate_limit=None, rate_burst=None, domains=None):
+        self.id = id
+        self.name = name
+        self.api_key = api_key
+        self.domains = domains or {}
+        self.limiter = TokenBucket(rate_limit or ADSTERRA_RATE_LIMIT, rate_burst or ADSTERRA_RATE_BURST)
+        self.breaker = CircuitBreaker(BREAKER_FAILURES, BREAKER_RESET_TIMEOUT)
+        self.upstream = RetryingClient(self.limiter, self.breaker, RETRY_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+        self.client = None  # httpx client, created by adsterra_api.get_client()
+
+    def update(self, name, api_key, rate_limit=None, rate_burst=None, domains=None):
+        # Reloaded settings are applied in place, the limiter keeps its state
+        self.name = name
+        self.api_key = api_key
+        self.domains = domains or {}
+        self.limiter.max_rate = rate_limit or ADSTERRA_RATE_LIMIT
+        self.limiter.rate = min(self.limiter.rate, self.limiter.max_rate)
+        self.limiter.capacity = rate_burst or ADSTERRA_RATE_BURST
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+def _config_tenant():
+    return Tenant(DEFAULT_TENANT_ID, "default", ADSTERRA_API_KEY, domains=DOMAINS)
+
+_tenants = {DEFAULT_TENANT_ID: _config_tenant()}
+_current = contextvars.ContextVar("tenant", default=None)
+
+def all_tenants():
+    return list(_tenants.values())
+
+def get(tenant_id):
+    # None for unknown ids, never another tenant: a stale id must not serve
+    # some other account's data
+    return _tenants.get(tenant_id)
+
+def for_session(session):
+    # Sessions are (user_id, username, login_time, last_activity, tenant_id).
+    # None without a session, or when its tenant is gone.
+    if not session or len(session) < 5 or session[4] is None:
+        return None
+    return get(session[4])
+
+def active():
+    # The tenant of the update or job being handled. Updates from users without
+    # a valid session have none, and anything that needs one fails loudly.
+    tenant = _current.get()
+    if tenant is None:
+        raise LookupError("No tenant is active")
+    return tenant
+
+def activate(tenant):
+    # For the rest of the current task (one update, see OrderedApplication)
+    _current.set(tenant)
+
+@contextmanager
+def using(tenant):
+    token = _current.set(tenant)
+    try:
+        yield tenant
+    finally:
+        _current.reset(token)
+
+def hash_password(password):
+    salt = os.urandom(16)
+    digest = hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
+
+def verify_password(password, password_hash):
+    try:
+        scheme, n, r, p, salt, digest = password_hash.split("$")
+    except (AttributeError, ValueError):
+        return False
+    if scheme != "scrypt":
+        return False
+    candidate = hashlib.scrypt(password.encode(), salt=bytes.fromhex(salt), n=int(n), r=int(r), p=int(p))
+    return hmac.compare_digest(candidate.hex(), digest)
+
+async def authenticate(username, password):
+    # -> tenant id, or None for unknown users and wrong passwords
+    account = await backend.get_account(username)
+    if account is None:
+        return None
+    password_hash, tenant_id = account
+    loop = asyncio.get_running_loop()
+    if not await loop.run_in_executor(_hash_executor, verify_password, password, password_hash):
+        return None
+    return tenant_id
+
+async def _seed():
+    # First start: the account from config.py becomes tenant 1, USER_DB its logins
+    if not ADSTERRA_API_KEY:
+        return []
+    await backend.save_tenant({
+        'id': DEFAULT_TENANT_ID,
+        'name': "default",
+        'api_key': ADSTERRA_API_KEY,
+        'rate_limit': ADSTERRA_RATE_LIMIT,
+        'rate_burst': ADSTERRA_RATE_BURST,
+        'domains': DOMAINS
+    })
+    loop = asyncio.get_running_loop()
+    for username, password in USER_DB.items():
+        if await backend.get_account(username) is None:
+            password_hash = await loop.run_in_executor(_hash_executor, hash_password, password)
+            await backend.save_account(username, password_hash, DEFAULT_TENANT_ID)
+    logger.info("Created the default tenant with %d login(s) from config", len(USER_DB))
+    return await backend.get_tenants()
+
+async def load():
+    # Startup and periodic job: picks up tenants added or changed in the backend
+    rows = await backend.get_tenants() or await _seed()
+    if not rows:
+        return
+
+    ids = set()
+    for row in rows:
+        row = dict(row)
+        tenant_id = row.pop('id')
+        ids.add(tenant_id)
+        if tenant_id in _tenants:
+            _tenants[tenant_id].update(**row)
+        else:
+            _tenants[tenant_id] = Tenant(tenant_id, **row)
+
+    for tenant_id in set(_tenants) - ids:
+        await _tenants.pop(tenant_id).close()
@@ -0,0 +1,332 @@
+import logging
+import os
+from datetime import date, datetime, timedelta
+
+import tenants
+from config import MUTABLE_DAYS, WAREHOUSE_DB, WAREHOUSE_HISTORY_DAYS, WAREHOUSE_MAX_SPAN
+from database import ConnectionPool
+from adsterra_api import fetch_stats
+
+logger = logging.getLogger(__name__)
+
+SYNC_GROUP_BY = ["date", "domain", "placement", "country"]
+
+# Report group_by -> stats_daily column (or expression)
+GROUP_COLUMNS = {
+    "date": "day",
+    "week": "date(day, '-' || ((CAST(strftime('%w', day) AS INTEGER) + 6) % 7) || ' days')",
+    "month": "substr(day, 1, 7)",
+    "country": "country",
+    "domain": "domain",
+    "placement": "placement"
+}
+
+# Rollup levels, coarsest first
+ROLLUP_LEVELS = ("year", "month", "week")
+
+# Rollups a group_by can be answered from (the rollup period must not be
+# split by the grouping, so a week can't serve a month report)
+GROUP_ROLLUPS = {
+    "date": (),
+    "week": ("week",),
+    "month": ("month",),
+    "country": ROLLUP_LEVELS,
+    "domain": ROLLUP_LEVELS,
+    "placement": ROLLUP_LEVELS
+}
+
+# One database file per tenant: stats.db for the default tenant, stats-<id>.db
+# for the others, so tenants never see each other's rows or wait on each
+# other's sync writes
+_pools = {}
+
+def _init_warehouse(conn):
+    c = conn.cursor()
+
+    # One row per day x domain x placement x country
+    c.execute('''CREATE TABLE IF NOT EXISTS stats_daily
+                 (day TEXT NOT NULL,
+                  domain INTEGER NOT NULL DEFAULT 0,
+                  placement INTEGER NOT NULL DEFAULT 0,
+                  country TEXT NOT NULL DEFAULT '',
+                  revenue REAL NOT NULL DEFAULT 0,
+                  impression INTEGER NOT NULL DEFAULT 0,
+                  clicks INTEGER NOT NULL DEFAULT 0,
+                  PRIMARY KEY (day, domain, placement, country))''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_stats_daily_domain
+                 ON stats_daily (domain, placement, day)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_stats_daily_country
+                 ON stats_daily (country, day)''')
+
+    # Week/month/year totals of stats_daily, kept up to date by _store_days.
+    # period is the first day of the week/month/year.
+    c.execute('''CREATE TABLE IF NOT EXISTS stats_rollup
+                 (level TEXT NOT NULL,
+                  period TEXT NOT NULL,
+                  domain INTEGER NOT NULL DEFAULT 0,
+                  placement INTEGER NOT NULL DEFAULT 0,
+                  country TEXT NOT NULL DEFAULT '',
+                  revenue REAL NOT NULL DEFAULT 0,
+                  impression INTEGER NOT NULL DEFAULT 0,
+                  clicks INTEGER NOT NULL DEFAULT 0,
+                  PRIMARY KEY (level, period, domain, placement, country))''')
+
+    # Days that have been fully synced from the API
+    c.execute('''CREATE TABLE IF NOT EXISTS sync_log
+                 (day TEXT PRIMARY KEY,
+                  synced_at TIMESTAMP)''')
+
+    conn.commit()
+
+    # Warehouses synced before rollups existed are backfilled once
+    if conn.execute("SELECT 1 FROM stats_rollup LIMIT 1").fetchone() is None:
+        c = conn.execute("SELECT MIN(day), MAX(day) FROM stats_daily")
+        first, last = c.fetchone()
+        if first:
+            with conn:
+                _update_rollups(conn, date.fromisoformat(first), date.fromisoformat(last))
+
+def warehouse_path(tenant_id):
+    if tenant_id == tenants.DEFAULT_TENANT_ID:
+        return WAREHOUSE_DB
+    root, ext = os.path.splitext(WAREHOUSE_DB)
+    return f"{root}-{tenant_id}{ext or '.db'}"
+
+def tenant_pool():
+    # Opened on the tenant's first query; the schema setup blocks once, briefly
+    tenant_id = tenants.active().id
+    pool = _pools.get(tenant_id)
+    if pool is None:
+        pool = ConnectionPool(warehouse_path(tenant_id))
+        pool.run_sync(_init_warehouse)
+        _pools[tenant_id] = pool
+    return pool
+
+def close_warehouse():
+    for pool in _pools.values():
+        pool.close()
+    _pools.clear()
+
+def _days_to_sync(conn, today=None):
+    today = today or datetime.now().date()
+    first = today - timedelta(days=WAREHOUSE_HISTORY_DAYS - 1)
+
+    c = conn.execute("SELECT day FROM sync_log WHERE day >= ?", (first.isoformat(),))
+    synced = {row[0] for row in c.fetchall()}
+
+    mutable_from = today - timedelta(days=MUTABLE_DAYS - 1)
+    days = []
+    day = first
+    while day <= today:
+        if day >= mutable_from or day.isoformat() not in synced:
+            days.append(day)
+        day += timedelta(days=1)
+    return days
+
+def contiguous_runs(days, max_span=WAREHOUSE_MAX_SPAN):
+    # Sorted dates -> [(start, end)] with no gaps and at most max_span days each
+    runs = []
+    for day in days:
+        if runs and day - runs[-1][1] == timedelta(days=1) and (day - runs[-1][0]).days < max_span:
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return [(start, end) for start, end in runs]
+
+def _item_id(item, field):
+    value = item.get(f"{field}_id", item.get(field))
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+def _store_days(conn, start, end, items):
+    rows = [
+        (
+            item.get("date"),
+            _item_id(item, "domain"),
+            _item_id(item, "placement"),
+            item.get("country") or "",
+            float(item.get("revenue", 0) or 0),
+            int(item.get("impression", 0) or 0),
+            int(item.get("clicks", 0) or 0)
+        )
+        for item in items
+        if item.get("date")
+    ]
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    with conn:
+        # Replace the whole range so rows that disappeared upstream go away too
+        conn.execute("DELETE FROM stats_daily WHERE day BETWEEN ? AND ?",
+                     (start.isoformat(), end.isoformat()))
+        conn.executemany('''INSERT INTO stats_daily
+                            (day, domain, placement, country, revenue, impression, clicks)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)
+                            ON CONFLICT (day, domain, placement, country) DO UPDATE SET
+                            revenue=revenue + excluded.revenue,
+                            impression=impression + excluded.impression,
+                            clicks=clicks + excluded.clicks''', rows)
+        day = start
+        synced = []
+        while day <= end:
+            synced.append((day.isoformat(), now))
+            day += timedelta(days=1)
+        conn.executemany("INSERT OR REPLACE INTO sync_log VALUES (?, ?)", synced)
+        _update_rollups(conn, start, end)
+
+def period_bounds(level, day):
+    if level == "week":
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=6)
+    if level == "month":
+        start = day.replace(day=1)
+        following = (start + timedelta(days=32)).replace(day=1)
+        return start, following - timedelta(days=1)
+    return day.replace(month=1, day=1), day.replace(month=12, day=31)
+
+def _update_rollups(conn, start, end):
+    # Recompute only the periods that contain a changed day
+    for level in ROLLUP_LEVELS:
+        periods = set()
+        day = start
+        while day <= end:
+            period = period_bounds(level, day)
+            periods.add(period)
+            day = period[1] + timedelta(days=1)
+
+        for period_start, period_end in periods:
+            conn.execute("DELETE FROM stats_rollup WHERE level=? AND period=?",
+                         (level, period_start.isoformat()))
+            conn.execute('''INSERT INTO stats_rollup
+                            SELECT ?, ?, domain, placement, country,
+                                   SUM(revenue), SUM(impression), SUM(clicks)
+                            FROM stats_daily
+                            WHERE day BETWEEN ? AND ?
+                            GROUP BY domain, placement, country''',
+                         (level, period_start.isoformat(), period_start.isoformat(), period_end.isoformat()))
+
+def plan_cover(start, end, levels=ROLLUP_LEVELS):
+    # Splits [start, end] into whole periods of the coarsest levels that fit,
+    # plus single days at the edges: -> [(level or "day", first day, last day)]
+    if start > end:
+        return []
+    if not levels:
+        return [("day", start, end)]
+
+    level, finer = levels[0], levels[1:]
+    periods = []
+    period_start = period_bounds(level, start)[0]
+    if period_start < start:
+        period_start = period_bounds(level, start)[1] + timedelta(days=1)
+    while period_start <= end:
+        period_end = period_bounds(level, period_start)[1]
+        if period_end > end:
+            break
+        periods.append((level, period_start, period_end))
+        period_start = period_end + timedelta(days=1)
+
+    if not periods:
+        return plan_cover(start, end, finer)
+    return (
+        plan_cover(start, periods[0][1] - timedelta(days=1), finer)
+        + periods
+        + plan_cover(periods[-1][2] + timedelta(days=1), end, finer)
+    )
+
+def _is_covered(conn, start_date, end_date):
+    # A missing date is never covered, the caller falls back to the API
+    if not start_date or not end_date:
+        return False
+    start = datetime.strptime(str(start_date), '%Y-%m-%d').date()
+    end = datetime.strptime(str(end_date), '%Y-%m-%d').date()
+
+    # Days that can still change are only as fresh as the last sync, they are
+    # left to the API and its shorter-lived cache
+    if end >= datetime.now().date() - timedelta(days=MUTABLE_DAYS - 1):
+        return False
+
+    c = conn.execute("SELECT COUNT(*) FROM sync_log WHERE day BETWEEN ? AND ?",
+                     (start.isoformat(), end.isoformat()))
+    count = c.fetchone()[0]
+
+    return count == (end - start).days + 1
+
+def _query_stats(conn, start_date, end_date, domain, placement, group_by):
+    # Same shape as the stats.json response, or None when the range isn't synced
+    if group_by not in GROUP_COLUMNS or not _is_covered(conn, start_date, end_date):
+        return None
+
+    filters = []
+    params = []
+    if domain:
+        filters.append("domain = ?")
+        params.append(int(domain))
+    if placement:
+        filters.append("placement = ?")
+        params.append(int(placement))
+
+    # Each part of the range is read from the coarsest table that covers it
+    # exactly, e.g. "This Year" is a few months plus weeks and days at the edges
+    start = date.fromisoformat(str(start_date))
+    end = date.fromisoformat(str(end_date))
+    column = GROUP_COLUMNS[group_by]
+    selects = []
+    select_params = []
+    for level, first, last in plan_cover(start, end, GROUP_ROLLUPS[group_by]):
+        if level == "day":
+            where = ["day BETWEEN ? AND ?", *filters]
+            selects.append(f'''SELECT {column} AS key, impression, clicks, revenue
+                               FROM stats_daily WHERE {" AND ".join(where)}''')
+            select_params += [first.isoformat(), last.isoformat(), *params]
+        else:
+            key = "period" if group_by in ("week", "month") else column
+            where = ["level = ?", "period = ?", *filters]
+            selects.append(f'''SELECT {key} AS key, impression, clicks, revenue
+                               FROM stats_rollup WHERE {" AND ".join(where)}''')
+            select_params += [level, first.isoformat(), *params]
+
+    if group_by in ("week", "month"):
+        # Rollup periods are stored as first days, months are reported as YYYY-MM
+        key = "substr(key, 1, 7)" if group_by == "month" else "key"
+    else:
+        key = "key"
+    order = "key" if group_by in ("date", "week", "month") else "revenue DESC"
+
+    c = conn.execute(f'''SELECT {key} AS key, SUM(impression), SUM(clicks), SUM(revenue) AS revenue
+                         FROM ({" UNION ALL ".join(selects)})
+                         GROUP BY 1
+                         ORDER BY {order}''', select_params)
+    rows = c.fetchall()
+
+    items = []
+    for key, impression, clicks, revenue in rows:
+        items.append({
+            group_by: key,
+            "impression": impression,
+            "clicks": clicks,
+            "ctr": (clicks / impression) * 100 if impression else 0,
+            "cpm": (revenue / impression) * 1000 if impression else 0,
+            "revenue": revenue
+        })
+    return {"items": items}
+
+async def query_stats(start_date, end_date, domain=None, placement=None, group_by="date"):
+    return await tenant_pool().run(_query_stats, start_date, end_date, domain, placement, group_by)
+
+async def sync():
+    for tenant in tenants.all_tenants():
+        with tenants.using(tenant):
+            await sync_tenant()
+
+async def sync_tenant():
+    pool = tenant_pool()
+    days = await pool.run(_days_to_sync)
+    for start, end in contiguous_runs(days):
+        stats = await fetch_stats(start.isoformat(), end.isoformat(), group_by=SYNC_GROUP_BY)
+        if stats is None:
+            logger.warning("Warehouse sync failed for %s..%s", start, end)
+            continue
+        await pool.run(_store_days, start, end, stats.get("items") or [])
+
+    logger.info("Warehouse synced %d day(s) for tenant %s", len(days), tenants.active().name)
@@ -0,0 +1,99 @@
+import asyncio
+import hmac
+import ipaddress
+import logging
+import signal
+
+from telegram import Update
+
+import webserver
+from config import (
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_MAX_CONNECTIONS
+)
+
+logger = logging.getLogger(__name__)
+
+def make_update_handler(application, secret=WEBHOOK_SECRET):
+    async def handle(request):
+        if request.method != "POST":
+            raise webserver.HTTPError(405)
+
+        # Telegram echoes the secret_token given to setWebhook in this header
+        token = request.headers.get("x-telegram-bot-api-secret-token", "")
+        if secret and not hmac.compare_digest(token.encode(), secret.encode()):
+            raise webserver.HTTPError(403)
+
+        try:
+            update = Update.de_json(request.json(), application.bot)
+        except (ValueError, TypeError, KeyError):
+            raise webserver.HTTPError(400)
+
+        # Processing happens on the Application's own update workers, so the
+        # response goes back to Telegram right away
+        await application.update_queue.put(update)
+        return 200, "text/plain", b"OK"
+
+    return handle
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+async def serve(application, routes=None):
+    # Counterpart of application.run_polling(): same lifecycle and hooks, but
+    # updates arrive over HTTP instead of getUpdates
+
+    # Without the secret anyone who can reach the port could post updates in
+    # the name of any logged-in user
+    if not WEBHOOK_SECRET:
+        if not is_loopback(WEBHOOK_LISTEN):
+            raise RuntimeError(
+                f"BOT_MODE=webhook listening on {WEBHOOK_LISTEN} needs WEBHOOK_SECRET "
+                "(or WEBHOOK_LISTEN=127.0.0.1 behind a proxy that checks it)"
+            )
+        logger.warning("WEBHOOK_SECRET is not set, webhook requests are not verified")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+
+    routes = dict(routes or {})
+    routes[f"/{WEBHOOK_PATH.strip('/')}"] = make_update_handler(application)
+    server = await webserver.serve(routes, WEBHOOK_LISTEN, WEBHOOK_PORT)
+    logger.info("Listening for webhook updates on %s:%s/%s", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+
+    try:
+        # Without a public URL the endpoint only receives what is posted locally
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH.strip('/')}",
+                secret_token=WEBHOOK_SECRET or None,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=Update.ALL_TYPES
+            )
+        await stop.wait()
+    finally:
+        server.close()
+        await server.wait_closed()
+        await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+def run(application):
+    asyncio.run(serve(application))
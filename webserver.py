@@ -0,0 +1,101 @@
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADERS = 100
+MAX_BODY = 1024 * 1024
+READ_TIMEOUT = 10
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+class Request:
+    __slots__ = ("method", "path", "query", "headers", "body")
+
+    def __init__(self, method, path, query, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+class HTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(REASONS.get(status, str(status)))
+        self.status = status
+
+async def read_request(reader):
+    request_line = (await reader.readline()).decode("latin-1").strip()
+    try:
+        method, target, _ = request_line.split(" ", 2)
+    except ValueError:
+        raise HTTPError(400)
+
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        if len(headers) >= MAX_HEADERS or ":" not in line:
+            raise HTTPError(400)
+        name, value = line.split(":", 1)
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length", "0"))
+    except ValueError:
+        raise HTTPError(400)
+    if length > MAX_BODY:
+        raise HTTPError(413)
+    body = await reader.readexactly(length) if length else b""
+
+    path, _, query = target.partition("?")
+    return Request(method.upper(), path, query, headers, body)
+
+async def serve(routes, host, port):
+    # Minimal HTTP/1.1 server: routes maps a path to
+    # `async def handler(request) -> (status, content_type, body_bytes)`.
+    # One request per connection, which is all webhook and scrape clients need.
+
+    async def handle(reader, writer):
+        try:
+            try:
+                request = await asyncio.wait_for(read_request(reader), READ_TIMEOUT)
+                handler = routes.get(request.path)
+                if handler is None:
+                    raise HTTPError(404)
+                status, content_type, body = await handler(request)
+            except HTTPError as e:
+                status, content_type, body = e.status, "text/plain", REASONS.get(e.status, "").encode()
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                return
+            except Exception:
+                logger.exception("HTTP handler failed")
+                status, content_type, body = 500, "text/plain", b"Internal Server Error"
+
+            writer.write(
+                f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode("latin-1") + body
+            )
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)